@@ -0,0 +1,137 @@
+"""Micro-benchmark for decoding database rows into records.
+
+Compares the old read path, which built a pydantic model per row from a
+dict of its columns and formatted its time with strftime, against the
+slotted records built positionally by tsuki.database._records with the
+times formatted by the cached template filter. Rows are synthetic, so no
+database is needed:
+
+    python -m benchmarks.decode --rows 1000
+"""
+import argparse
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from pydantic import BaseModel
+
+from tsuki.database import _records
+from tsuki.models import CommentResponse, PostResponse, UserRecord
+from tsuki.templating import format_timestamp
+
+
+# The models the read path used to build
+class OldUser(BaseModel):
+    email: str
+    username: str
+    password: str
+    verified: bool
+    created_at: datetime
+
+
+class OldPostResponse(BaseModel):
+    username: str
+    id: str
+    body: str
+    created_at: datetime
+    avatar: Optional[str] = None
+
+
+class OldCommentResponse(BaseModel):
+    post_id: str
+    id: str
+    username: str
+    body: str
+    created_at: str
+    self_: bool = False
+
+
+def synthetic_rows(count: int):
+    start = datetime(2022, 1, 1, tzinfo=timezone.utc)
+    times = [start + timedelta(seconds=index * 37) for index in range(count)]
+    users = [
+        (f"user{index}@example.com", f"user{index}", "x" * 60, True, times[index])
+        for index in range(count)
+    ]
+    posts = [
+        (f"user{index % 100}", f"{index:032x}", "post body " * 10, times[index], None)
+        for index in range(count)
+    ]
+    comments = [
+        (f"{index:032x}", f"{index:032x}", f"user{index}", "comment", times[index])
+        for index in range(count)
+    ]
+    return {"users": users, "posts": posts, "comments": comments}
+
+
+def old_decode(kind: str, rows: list) -> list:
+    if kind == "users":
+        records = []
+        for data in rows:
+            user = OldUser(
+                **{key: data[index] for index, key in enumerate(OldUser.__fields__)}
+            )
+            user.created_at = user.created_at.strftime("%d %B %Y, %H:%M:%S")
+            records.append(user)
+        return records
+    if kind == "posts":
+        fields = list(OldPostResponse.__fields__.keys())
+        records = []
+        for data in rows:
+            post = OldPostResponse(
+                **{key: data[index] for index, key in enumerate(fields)}
+            )
+            post.created_at = post.created_at.strftime("%d %B %Y, %H:%M:%S")
+            records.append(post)
+        return records
+    fields = list(OldCommentResponse.__fields__.keys())
+    records = []
+    for data in rows:
+        data = list(data)
+        data[4] = data[4].strftime("%d %B %Y, %H:%M:%S")
+        records.append(
+            OldCommentResponse(
+                **{key: data[index] for index, key in enumerate(fields[:-1])}
+            )
+        )
+    return records
+
+
+def new_decode(kind: str, rows: list) -> list:
+    record = {"users": UserRecord, "posts": PostResponse}.get(kind, CommentResponse)
+    records = _records(record, rows)
+    # What the templates do when rendering the records
+    for item in records:
+        format_timestamp(item.created_at)
+    return records
+
+
+def timed(decode, kind: str, rows: list, repeat: int, cold: bool) -> float:
+    timings = []
+    for _ in range(repeat):
+        if cold:
+            format_timestamp.cache_clear()
+        start = time.perf_counter()
+        decode(kind, rows)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+    rows = synthetic_rows(args.rows)
+    print(f"median decode time of {args.rows} rows")
+    print(f"  {'kind':<9} {'old':>9} {'new cold':>9} {'new warm':>9}")
+    for kind, data in rows.items():
+        old = timed(old_decode, kind, data, args.repeat, False)
+        # Cold formats every time once, warm finds them in the filter's cache
+        cold = timed(new_decode, kind, data, args.repeat, True)
+        warm = timed(new_decode, kind, data, args.repeat, False)
+        print(
+            f"  {kind:<9} {old * 1000:>7.2f}ms {cold * 1000:>7.2f}ms "
+            f"{warm * 1000:>7.2f}ms"
+        )
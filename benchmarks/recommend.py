@@ -0,0 +1,79 @@
+"""Micro-benchmark for the explore recommendation kernel.
+
+Builds a PostIndex over synthetic corpora and times PostIndex.top_k for a
+user with 100 liked posts, reporting latency and peak memory. Run from the
+repository root with the same environment as the app (a .env file):
+
+    python -m benchmarks.recommend
+"""
+import argparse
+import statistics
+import time
+import tracemalloc
+
+import numpy
+
+from tsuki.recommender import PostIndex
+
+VOCABULARY = 20000
+STOP_WORDS = 100
+LIKED = 100
+
+
+def synthetic_posts(count: int, seed: int = 0):
+    """Posts of 5-40 words drawn from a Zipf distributed vocabulary. The
+    most frequent ranks are skipped, standing in for the stop words the
+    vectorizer drops."""
+    rng = numpy.random.default_rng(seed)
+    words = [f"w{index}" for index in range(VOCABULARY)]
+    posts = []
+    for index in range(count):
+        length = rng.integers(5, 40)
+        ranks = numpy.minimum(rng.zipf(1.3, length) + STOP_WORDS, VOCABULARY) - 1
+        posts.append(
+            (
+                f"{index:032x}",
+                f"user{index % 1000}",
+                " ".join(words[rank] for rank in ranks),
+            )
+        )
+    return posts
+
+
+def benchmark(count: int, repeat: int):
+    posts = synthetic_posts(count)
+    index = PostIndex()
+    start = time.perf_counter()
+    index.build(posts)
+    build = time.perf_counter() - start
+
+    liked = [(_id, body) for _id, _, body in posts[:: max(count // LIKED, 1)]]
+    liked = liked[:LIKED]
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        vectors = index.vectors(liked)
+        index.top_k(vectors, 30, "user0", [_id for _id, _ in liked])
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    vectors = index.vectors(liked)
+    index.top_k(vectors, 30, "user0", [_id for _id, _ in liked])
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(
+        f"{count:>7} posts | build {build:8.2f}s | "
+        f"top_k median {statistics.median(timings) * 1000:8.2f}ms "
+        f"p95 {sorted(timings)[int(len(timings) * 0.95) - 1] * 1000:8.2f}ms | "
+        f"peak {peak / 2**20:8.2f}MiB"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    for size in args.sizes:
+        benchmark(size, args.repeat)
@@ -0,0 +1,140 @@
+"""Benchmark for username search in each of its modes.
+
+Fills t_users in a scratch schema with synthetic usernames and times the
+substring, prefix and similarity searches before and after creating the
+t_users indexes of the migrations in tsuki/resources/migrations, printing
+the plan each query used. Needs the database from POSTGRES_URI, the
+scratch schema is dropped afterwards:
+
+    python -m benchmarks.search --users 1000000
+"""
+import argparse
+import re
+import statistics
+import time
+from typing import List
+
+import psycopg
+from psycopg import sql
+
+from tsuki import database
+from tsuki.config import secrets
+from tsuki.migrations import read_migrations
+
+SCHEMA = "benchmark_search"
+TERMS = {
+    "substring": ["a1b", "e5f0", "zz"],
+    "prefix": ["a", "b4", "c7e", "d00f"],
+    "similar": ["a1b2c3", "f00ba7"],
+}
+
+
+def indexes(trigram: bool) -> List[str]:
+    """CREATE INDEX statements of the migrations for t_users, the trigram
+    ones only when pg_trgm is available"""
+    return [
+        statement
+        for migration in read_migrations()
+        for statement in migration.statements()
+        if statement.startswith("CREATE INDEX")
+        and re.search(r"\bON\s+t_users\b", statement)
+        and (trigram or "gin_trgm_ops" not in statement)
+    ]
+
+
+def fill(cursor: psycopg.Cursor, users: int):
+    """Usernames of a letter and 5-14 hex digits, so every prefix and
+    substring length matches a realistic share of the users"""
+    cursor.execute(
+        """CREATE TABLE t_users (
+            email       VARCHAR(320)    UNIQUE NOT NULL,
+            username    VARCHAR(32)     PRIMARY KEY,
+            password    VARCHAR(64)     NOT NULL,
+            verified    BOOL            NOT NULL,
+            created_at  TIMESTAMPTZ     NOT NULL
+        )"""
+    )
+    cursor.execute(
+        """INSERT INTO t_users
+        SELECT name || '@example.com', name, '', TRUE, now()
+        FROM (
+            SELECT chr(97 + i %% 26) || substr(md5(i::TEXT), 1, 5 + i %% 10) AS name
+            FROM generate_series(1, %s) AS i
+        ) AS names
+        ON CONFLICT DO NOTHING""",
+        (users,),
+    )
+    cursor.execute("ANALYZE t_users")
+
+
+def measure(cursor: psycopg.Cursor, mode: str, term: str, repeat: int):
+    condition, order, params = database.username_filter(term, mode)
+    query = sql.SQL(
+        "SELECT username FROM t_users WHERE {} ORDER BY {} LIMIT %(limit)s"
+    ).format(condition, order)
+    params = {**params, "limit": 10}
+    cursor.execute(sql.SQL("EXPLAIN ") + query, params)
+    plan = " > ".join(
+        line.strip().lstrip("-> ").split("  ")[0]
+        for (line,) in cursor.fetchall()
+        if "Scan" in line or "Sort" in line
+    )
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        cursor.execute(query, params)
+        cursor.fetchall()
+        timings.append(time.perf_counter() - start)
+    print(
+        f"  {mode:<9} {term!r:<10} median "
+        f"{statistics.median(timings) * 1000:9.2f}ms max "
+        f"{max(timings) * 1000:9.2f}ms | {plan}"
+    )
+
+
+def benchmark(users: int, repeat: int):
+    with psycopg.connect(secrets.POSTGRES_URI, autocommit=True) as connection:
+        cursor = connection.cursor()
+        cursor.execute(
+            "SELECT EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm')"
+        )
+        trigram = cursor.fetchone()[0]
+        if trigram:
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        # username_filter falls back to substring searches without pg_trgm
+        database._trigram = trigram
+        modes = [mode for mode in TERMS if trigram or mode != "similar"]
+        cursor.execute(
+            sql.SQL("DROP SCHEMA IF EXISTS {} CASCADE").format(sql.Identifier(SCHEMA))
+        )
+        cursor.execute(sql.SQL("CREATE SCHEMA {}").format(sql.Identifier(SCHEMA)))
+        cursor.execute(
+            sql.SQL("SET search_path TO {}, public").format(sql.Identifier(SCHEMA))
+        )
+        try:
+            start = time.perf_counter()
+            fill(cursor, users)
+            print(f"{users} users, filled in {time.perf_counter() - start:.1f}s")
+            if not trigram:
+                print("  pg_trgm is not available, similar mode is skipped")
+            for phase in ("unindexed", "indexed"):
+                if phase == "indexed":
+                    for index in indexes(trigram):
+                        cursor.execute(index)
+                    cursor.execute("ANALYZE t_users")
+                print(phase)
+                for mode in modes:
+                    for term in TERMS[mode]:
+                        measure(cursor, mode, term, repeat)
+        finally:
+            cursor.execute(
+                sql.SQL("DROP SCHEMA {} CASCADE").format(sql.Identifier(SCHEMA))
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    benchmark(args.users, args.repeat)
@@ -0,0 +1,124 @@
+"""Concurrency test for toggle_vote and toggle_follow.
+
+Many tasks toggle the same vote and the same follow at once, like a burst
+of double clicks. Afterwards there must be at most one vote and one follow
+row, and the counters must match the rows. The script also reports toggle
+latency. It creates its users and post in the database from POSTGRES_URI
+and deletes them afterwards, and exits with an error if a check fails.
+With --buffered votes go through the write-behind vote buffer:
+
+    python -m benchmarks.toggles --tasks 50 --toggles 20 [--buffered]
+"""
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+from uuid import uuid4
+
+from tsuki import database
+from tsuki.models import Post, User
+from tsuki.votes import VoteBuffer
+
+VOTER = "benchmark_voter"
+AUTHOR = "benchmark_author"
+
+
+async def hammer(toggle, tasks: int, toggles: int) -> list:
+    """Run the toggle from many tasks at once, returning the latencies"""
+    timings = []
+
+    async def worker():
+        for _ in range(toggles):
+            start = time.perf_counter()
+            await toggle()
+            timings.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(worker() for _ in range(tasks)))
+    return timings
+
+
+async def count(query: str, *params) -> int:
+    async with database.get_pool().connection() as connection:
+        cursor = await connection.execute(query, params)
+        return (await cursor.fetchone())[0]
+
+
+def report(name: str, timings: list, elapsed: float):
+    print(
+        f"  {name:<7} {len(timings)} toggles in {elapsed:.2f}s, "
+        f"{len(timings) / elapsed:.0f}/s, median "
+        f"{statistics.median(timings) * 1000:.2f}ms max "
+        f"{max(timings) * 1000:.2f}ms"
+    )
+
+
+async def benchmark(tasks: int, toggles: int, buffered: bool) -> bool:
+    await database.open_pool()
+    await database.initdb()
+    now = datetime.now(timezone.utc)
+    for username in (VOTER, AUTHOR):
+        await database.delete_user(username)
+        await database.create_user(
+            User(
+                email=f"{username}@example.com",
+                username=username,
+                password="",
+                verified=True,
+                created_at=now,
+            )
+        )
+    post = Post(id=uuid4().hex, body="benchmark", created_at=now)
+    await database.create_post(AUTHOR, post)
+    buffer = VoteBuffer(buffered, 500, 0.25)
+    buffer.start()
+    try:
+        start = time.perf_counter()
+        timings = await hammer(lambda: buffer.toggle(VOTER, post.id), tasks, toggles)
+        # Included in the time, the votes are only durable once written
+        await buffer.stop()
+        report("vote", timings, time.perf_counter() - start)
+        start = time.perf_counter()
+        timings = await hammer(
+            lambda: database.toggle_follow(VOTER, AUTHOR), tasks, toggles
+        )
+        report("follow", timings, time.perf_counter() - start)
+
+        votes = await count("SELECT COUNT(*) FROM votes WHERE id = %s", post.id)
+        follows = await count(
+            "SELECT COUNT(*) FROM follows WHERE username = %s AND following = %s",
+            VOTER,
+            AUTHOR,
+        )
+        counters = await database.read_post_counters(post.id)
+        followers = (await database.read_user_counters(AUTHOR))["followers"]
+        following = (await database.read_user_counters(VOTER))["following"]
+        timeline = await count(
+            "SELECT COUNT(*) FROM timelines WHERE username = %s", VOTER
+        )
+        checks = {
+            "at most one vote row": votes <= 1,
+            "at most one follow row": follows <= 1,
+            "vote counter matches": counters["votes"] == votes,
+            "follower counter matches": followers == follows,
+            "following counter matches": following == follows,
+            "timeline matches the follow": timeline == follows,
+        }
+        for check, passed in checks.items():
+            print(f"  {'ok' if passed else 'FAILED':<6} {check}")
+        return all(checks.values())
+    finally:
+        for username in (VOTER, AUTHOR):
+            await database.delete_user(username)
+        await database.close_pool()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tasks", type=int, default=50)
+    parser.add_argument("--toggles", type=int, default=20)
+    parser.add_argument("--buffered", action="store_true")
+    args = parser.parse_args()
+    if not asyncio.run(benchmark(args.tasks, args.toggles, args.buffered)):
+        sys.exit(1)
@@ -0,0 +1,81 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Mapping, Tuple
+
+from tsuki.config import secrets
+from tsuki.invalidation import subscribe
+
+# Returned by get for keys that are missing or expired, None is a valid value
+MISSING = object()
+
+
+class TTLCache:
+    """In-process LRU cache whose entries also expire after a time to live,
+    with hit and miss statistics.
+
+    Args:
+        name (str): Name used when reporting statistics.
+        size (int): Number of entries kept, the least recently used one is
+        evicted to make room for a new one.
+        ttl (float): Seconds an entry is served for after it was set.
+    """
+
+    def __init__(self, name: str, size: int, ttl: float):
+        self.name = name
+        self.size = size
+        self.ttl = ttl
+        # Entries as (expiry, value), least recently used first
+        self._entries: OrderedDict[Hashable, Tuple[float, Any]] = OrderedDict()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Any:
+        """Value of a key, MISSING when it isn't cached or has expired"""
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self._stats["misses"] += 1
+            return MISSING
+        self._entries.move_to_end(key)
+        self._stats["hits"] += 1
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any):
+        if self.size <= 0:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def invalidate(self, key: Hashable):
+        if self._entries.pop(key, None) is not None:
+            self._stats["invalidations"] += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Mapping[str, float]:
+        lookups = self._stats["hits"] + self._stats["misses"]
+        return {
+            **self._stats,
+            "hit_rate": self._stats["hits"] / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+            "size": self.size,
+        }
+
+
+# Usernames of decoded authorization tokens, and the users they belong to
+token_cache = TTLCache("token", secrets.USER_CACHE_SIZE, secrets.USER_CACHE_TTL)
+user_cache = TTLCache("user", secrets.USER_CACHE_SIZE, secrets.USER_CACHE_TTL)
+caches = [token_cache, user_cache]
+subscribe("user", user_cache.invalidate, user_cache.clear)
+
+
+def cache_stats() -> Dict[str, Mapping[str, float]]:
+    """Hit rates and sizes of every cache"""
+    return {cache.name: cache.stats() for cache in caches}
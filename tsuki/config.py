@@ -13,6 +13,60 @@ class EnvVariables(BaseSettings):
     CLIENT_SECRET: str
     EXPIRY: str
     FREEIMAGE_API_KEY: str
+    # Connection pool settings, timeouts and idle times are in seconds. A
+    # page view holds up to five connections at once, see load_page
+    POOL_MIN_SIZE: int = 2
+    POOL_MAX_SIZE: int = 25
+    POOL_TIMEOUT: float = 30.0
+    POOL_MAX_IDLE: float = 600.0
+    POOL_MAX_LIFETIME: float = 3600.0
+    # Executors for CPU heavy work, the queue size is per executor
+    PASSWORD_WORKERS: int = 4
+    RECOMMEND_WORKERS: int = 2
+    VECTORIZE_WORKERS: int = 2
+    EXECUTOR_QUEUE_SIZE: int = 64
+    EXECUTOR_TIMEOUT: float = 30.0
+    # Background explore recommendations, intervals are in seconds
+    RECOMMEND_COUNT: int = 100
+    RECOMMEND_INTERVAL: float = 60.0
+    RECOMMEND_STALENESS: float = 900.0
+    # Trending posts, the window and half life are in seconds, every
+    # TRENDING_BLEND-th explore post is a trending one
+    TRENDING_WINDOW: float = 86400.0
+    TRENDING_HALF_LIFE: float = 21600.0
+    TRENDING_VOTE_WEIGHT: float = 1.0
+    TRENDING_COMMENT_WEIGHT: float = 2.0
+    TRENDING_BLEND: int = 4
+    # Home timelines keep the newest TIMELINE_SIZE posts per user, posts of
+    # authors with more than FANOUT_LIMIT followers are read at feed time
+    TIMELINE_SIZE: int = 800
+    FANOUT_LIMIT: int = 10000
+    TIMELINE_PRUNE_INTERVAL: float = 3600.0
+    # Seconds between recounts of the denormalized post, follow, vote and
+    # comment counters
+    COUNTER_RECONCILE_INTERVAL: float = 3600.0
+    # Logged in users are cached for USER_CACHE_TTL seconds, up to
+    # USER_CACHE_SIZE of them
+    USER_CACHE_SIZE: int = 10000
+    USER_CACHE_TTL: float = 60.0
+    # Seconds to wait before reconnecting the cache invalidation listener
+    INVALIDATION_RECONNECT_INTERVAL: float = 5.0
+    # Write-behind votes, buffered toggles are written every
+    # VOTE_FLUSH_INTERVAL seconds or once VOTE_FLUSH_SIZE are buffered
+    VOTE_BUFFER: bool = False
+    VOTE_FLUSH_SIZE: int = 500
+    VOTE_FLUSH_INTERVAL: float = 0.25
+    # Statements slower than SLOW_QUERY_THRESHOLD seconds are logged, and
+    # the plans of a SLOW_QUERY_SAMPLE_RATE share of them captured, taking
+    # up to SLOW_QUERY_EXPLAIN_TIMEOUT seconds. The last SLOW_QUERY_LOG_SIZE
+    # are kept.
+    SLOW_QUERY_THRESHOLD: float = 0.2
+    SLOW_QUERY_SAMPLE_RATE: float = 0.1
+    SLOW_QUERY_EXPLAIN_TIMEOUT: float = 5.0
+    SLOW_QUERY_LOG_SIZE: int = 100
+    # Bearer token of the internal endpoints such as /metrics, they are
+    # disabled while it is empty
+    ADMIN_TOKEN: str = ""
 
     class Config:
         env_file = ".env"
@@ -1,37 +1,156 @@
-import os
-from typing import Any, List, Mapping, Tuple
+import base64
+import inspect
+import json
+from datetime import datetime
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    Sequence,
+    Tuple,
+    TypeVar,
+)
 
-import psycopg
-from psycopg import sql
+from psycopg import AsyncCursor, sql
+from psycopg_pool import AsyncConnectionPool
 
 from tsuki.config import secrets
-from tsuki.models import Comment, Post, PostResponse, User
+from tsuki.invalidation import evict, publish
+from tsuki.metrics import timed_call
+from tsuki.migrations import migrate
+from tsuki.models import (
+    Comment,
+    CommentResponse,
+    Post,
+    PostResponse,
+    User,
+    UserRecord,
+    UserSearchResult,
+)
+from tsuki.queries import execute
 
+_pool: AsyncConnectionPool | None = None
+# Whether the pg_trgm extension is installed, checked by initdb
+_trigram = False
+SEARCH_MODES = ("substring", "similar", "prefix")
+# Columns update_user can change
+USER_COLUMNS = ("email", "username", "password", "verified")
+Record = TypeVar("Record")
 
-async def initdb():
-    """Run the init.sql script for creating tables for tsuki"""
-    connection = await psycopg.AsyncConnection.connect(
-        secrets.POSTGRES_URI, autocommit=True
+
+async def open_pool():
+    """Create the process-wide connection pool shared by every database
+    function. Called once from the startup hook."""
+    global _pool
+    if _pool is not None:
+        return
+    _pool = AsyncConnectionPool(
+        secrets.POSTGRES_URI,
+        min_size=secrets.POOL_MIN_SIZE,
+        max_size=secrets.POOL_MAX_SIZE,
+        timeout=secrets.POOL_TIMEOUT,
+        max_idle=secrets.POOL_MAX_IDLE,
+        max_lifetime=secrets.POOL_MAX_LIFETIME,
+        kwargs={"autocommit": True},
+        open=False,
     )
-    async with connection:
-        async with connection.cursor() as cursor:
-            current_dir = os.path.dirname(os.path.realpath(__file__))
-            with open(os.path.join(current_dir, "resources", "init.sql")) as sql_file:
-                await cursor.execute(sql_file.read())
+    await _pool.open(wait=True)
+
+
+async def close_pool():
+    """Close the connection pool, called from the shutdown hook"""
+    global _pool
+    if _pool is None:
+        return
+    await _pool.close()
+    _pool = None
+
+
+def get_pool() -> AsyncConnectionPool:
+    if _pool is None:
+        raise RuntimeError("Connection pool is not open, call open_pool() first")
+    return _pool
+
+
+def pool_stats() -> Mapping[str, int]:
+    """Current pool size and usage counters, useful for sizing the pool"""
+    if _pool is None:
+        return {}
+    return _pool.get_stats()
+
+
+def encode_cursor(*values: Any) -> str:
+    """Opaque page cursor holding the sort key of the last row of a page"""
+    values = [
+        value.isoformat() if isinstance(value, datetime) else value for value in values
+    ]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor: str | None, length: int) -> List[Any] | None:
+    """Sort key held by a page cursor, None for a missing or invalid one"""
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        return None
+    if not isinstance(values, list) or len(values) != length:
+        return None
+    return values
+
+
+def _next_page(
+    results: List[Any], limit: int, *columns: int
+) -> Tuple[List[Any], str | None]:
+    """Drop the extra row fetched to tell whether another page follows, and
+    build that page's cursor from the given columns of the last row kept"""
+    if len(results) <= limit:
+        return results, None
+    results = results[:limit]
+    return results, encode_cursor(*(results[-1][column] for column in columns))
+
+
+def _records(
+    record: Callable[..., Record],
+    rows: Iterable[Sequence[Any]],
+    width: int | None = None,
+) -> List[Record]:
+    """Build records straight from rows, passing the columns positionally,
+    or only the first width of them"""
+    if width is None:
+        return [record(*row) for row in rows]
+    return [record(*row[:width]) for row in rows]
+
+
+async def initdb():
+    """Apply the pending schema migrations and check which extensions are
+    installed"""
+    global _trigram
+    async with get_pool().connection() as connection:
+        await migrate(connection)
+        cursor = await connection.execute(
+            "SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')"
+        )
+        _trigram = (await cursor.fetchone())[0]
 
 
 # TODO:
 # Use Redis for storing shortened URLs for 48 hours.
 async def create_short_url(token: Any, _id: str) -> bool:
     """Shortened token URL for verifying a user"""
-    connection = await psycopg.AsyncConnection.connect(
-        secrets.POSTGRES_URI, autocommit=True
-    )
     try:
-        async with connection:
+        async with get_pool().connection() as connection:
             async with connection.cursor() as cursor:
-                await cursor.execute(
-                    "INSERT INTO shorturl VALUES (%s, %s)", (token, _id)
+                await execute(
+                    cursor,
+                    "create_short_url",
+                    (token, _id),
+                    query="INSERT INTO shorturl VALUES (%s, %s)",
                 )
                 return True
     except:
@@ -40,13 +159,10 @@ async def create_short_url(token: Any, _id: str) -> bool:
 
 async def read_short_url(_id: str) -> str | None:
     """Fetch the shortened URL"""
-    connection = await psycopg.AsyncConnection.connect(
-        secrets.POSTGRES_URI, autocommit=True
-    )
     try:
-        async with connection:
+        async with get_pool().connection() as connection:
             async with connection.cursor() as cursor:
-                await cursor.execute("SELECT token FROM shorturl WHERE id = %s", (_id,))
+                await execute(cursor, "read_short_url", (_id,))
                 result = await cursor.fetchone()
                 return result[0]
     except:
@@ -54,302 +170,653 @@ async def read_short_url(_id: str) -> str | None:
 
 
 async def delete_short_url(_id: str):
-    connection = await psycopg.AsyncConnection.connect(
-        secrets.POSTGRES_URI, autocommit=True
-    )
-    async with connection:
+    async with get_pool().connection() as connection:
         async with connection.cursor() as cursor:
-            await cursor.execute("DELETE FROM shorturl WHERE id = %s", (_id,))
+            await execute(
+                cursor,
+                "delete_short_url",
+                (_id,),
+                query="DELETE FROM shorturl WHERE id = %s",
+            )
 
 
 async def create_user(user: User) -> bool:
-    connection = await psycopg.AsyncConnection.connect(
-        secrets.POSTGRES_URI, autocommit=True
-    )
+    """Create a user along with their zeroed counters"""
     try:
-        async with connection:
+        async with get_pool().connection() as connection:
             async with connection.cursor() as cursor:
-                await cursor.execute(
-                    """INSERT INTO t_users
-                VALUES (%(email)s, %(username)s, %(password)s, %(verified)s, %(created_at)s)""",
+                await execute(
+                    cursor,
+                    "create_user",
                     user.dict(),
+                    query="""WITH created AS (
+                        INSERT INTO t_users
+                            (email, username, password, verified, created_at)
+                        VALUES (%(email)s, %(username)s, %(password)s,
+                            %(verified)s, %(created_at)s)
+                        RETURNING username
+                    )
+                    INSERT INTO user_counters (username)
+                    SELECT username FROM created""",
                 )
                 return True
     except:
         return False
 
 
-async def read_user(username: str) -> User | None:
-    connection = await psycopg.AsyncConnection.connect(
-        secrets.POSTGRES_URI, autocommit=True
-    )
+async def read_user(username: str) -> UserRecord | None:
     try:
-        async with connection:
+        async with get_pool().connection() as connection:
             async with connection.cursor() as cursor:
-                await cursor.execute(
-                    "SELECT * FROM t_users WHERE username = %s", (username,)
-                )
+                await execute(cursor, "read_user", (username,))
                 result = await cursor.fetchone()
-                user = User(
-                    **{
-                        key: result[index]
-                        for index, key in enumerate(User.__fields__.keys())
-                    }
-                )
-                user.created_at = user.created_at.strftime("%d %B %Y, %H:%M:%S")
-                return user
+                return UserRecord(*result) if result else None
     except:
         return None
 
 
-async def read_users(username: str, limit: int = 10) -> List[User]:
-    """Read multiple users at the same time, default limit 10"""
-    connection = await psycopg.AsyncConnection.connect(
-        secrets.POSTGRES_URI, autocommit=True
+def username_filter(
+    username: str, mode: str = "substring", after: str | None = None
+) -> Tuple[sql.Composable, sql.Composable, Mapping[str, Any]]:
+    """Condition and ordering matching usernames in one of the search
+    modes, along with their parameters.
+
+    substring matches anywhere in the username, prefix matches the start
+    using the text_pattern_ops index in its order, and similar ranks by
+    trigram similarity, falling back to substring without pg_trgm. Only
+    usernames ordered after the given one match, for paging.
+    """
+    pattern = username.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    params = {"after": after}
+    if mode == "prefix":
+        return (
+            sql.SQL(
+                """username LIKE %(pattern)s
+                AND (%(after)s::VARCHAR IS NULL OR username ~>~ %(after)s)"""
+            ),
+            sql.SQL("username USING ~<~"),
+            {**params, "pattern": pattern + "%"},
+        )
+    if mode == "similar" and _trigram:
+        return (
+            sql.SQL(
+                """username %% %(term)s
+                AND (%(after)s::VARCHAR IS NULL
+                    OR similarity(username, %(term)s) < similarity(%(after)s, %(term)s)
+                    OR (similarity(username, %(term)s) = similarity(%(after)s, %(term)s)
+                        AND username > %(after)s))"""
+            ),
+            sql.SQL("similarity(username, %(term)s) DESC, username"),
+            {**params, "term": username},
+        )
+    return (
+        sql.SQL(
+            """username LIKE %(pattern)s
+            AND (%(after)s::VARCHAR IS NULL OR username > %(after)s)"""
+        ),
+        sql.SQL("username"),
+        {**params, "pattern": "%" + pattern + "%"},
     )
+
+
+async def read_users(
+    username: str, limit: int = 10, mode: str = "substring"
+) -> List[UserRecord]:
+    """Read multiple users at the same time, default limit 10"""
+    condition, order, params = username_filter(username, mode)
     try:
-        async with connection:
+        async with get_pool().connection() as connection:
             async with connection.cursor() as cursor:
-                await cursor.execute(
-                    """SELECT * FROM t_users WHERE username LIKE %s
-                    ORDER BY username
-                    LIMIT %s""",
-                    ("%" + username + "%", limit),
+                await execute(
+                    cursor,
+                    "read_users",
+                    {**params, "limit": limit},
+                    query=sql.SQL(
+                        """SELECT email, username, password, verified, created_at
+                        FROM t_users WHERE {} ORDER BY {} LIMIT %(limit)s"""
+                    ).format(condition, order),
                 )
-                results = await cursor.fetchall()
-                users = []
-                for data in results:
-                    user = User(
-                        **{
-                            key: data[index]
-                            for index, key in enumerate(User.__fields__.keys())
-                        }
-                    )
-                    user.created_at = user.created_at.strftime("%d %B %Y, %H:%M:%S")
-                    users.append(user)
-                return users
+                return _records(UserRecord, await cursor.fetchall())
     except:
         return []
 
 
-async def update_user(username: str, updates: Mapping[str, Any]) -> bool:
-    """Update user profile information"""
-    connection = await psycopg.AsyncConnection.connect(
-        secrets.POSTGRES_URI, autocommit=True
-    )
+async def search_users(
+    username: str,
+    viewer: str | None = None,
+    limit: int = 10,
+    mode: str = "substring",
+    cursor: str | None = None,
+) -> Tuple[List[UserSearchResult], str | None]:
+    """Search a page of users along with their avatar, post, follower and
+    following counts and whether the viewer follows them, in a single
+    query, and the cursor of the next page"""
+    after = decode_cursor(cursor, 1)
+    condition, order, params = username_filter(username, mode, after and after[0])
     try:
-        async with connection:
+        async with get_pool().connection() as connection:
             async with connection.cursor() as cursor:
-                for column in updates:
-                    await cursor.execute(
-                        sql.SQL(
-                            "UPDATE t_users SET {} = {} WHERE username = {}"
-                        ).format(
-                            sql.Identifier(column),
-                            updates[column],
-                            username,
-                        )
+                # Only the matches expose a username column, so the order
+                # applies to the outer query as well
+                await execute(
+                    cursor,
+                    "search_users",
+                    {**params, "viewer": viewer, "limit": limit + 1},
+                    query=sql.SQL(
+                        """SELECT username, avatar.url,
+                            COALESCE(counters.posts, 0),
+                            COALESCE(counters.followers, 0),
+                            COALESCE(counters.following, 0),
+                            CASE WHEN %(viewer)s::VARCHAR IS NULL
+                                OR username = %(viewer)s THEN NULL
+                            ELSE EXISTS (
+                                SELECT 1 FROM follows
+                                WHERE follows.username = %(viewer)s
+                                AND follows.following = matches.username
+                            ) END
+                        FROM (
+                            SELECT username FROM t_users WHERE {condition}
+                            ORDER BY {order}
+                            LIMIT %(limit)s
+                        ) AS matches
+                        LEFT JOIN LATERAL (
+                            SELECT url FROM avatars
+                            WHERE avatars.username = matches.username
+                        ) AS avatar ON TRUE
+                        LEFT JOIN LATERAL (
+                            SELECT posts, followers, following FROM user_counters
+                            WHERE user_counters.username = matches.username
+                        ) AS counters ON TRUE
+                        ORDER BY {order}"""
+                    ).format(condition=condition, order=order),
+                )
+                results, next_cursor = _next_page(await cursor.fetchall(), limit, 0)
+                return _records(UserSearchResult, results), next_cursor
+    except:
+        return [], None
+
+
+async def update_user(username: str, updates: Mapping[str, Any]) -> bool:
+    """Update user profile information in a single statement"""
+    if not updates.keys() <= set(USER_COLUMNS):
+        return False
+    try:
+        async with get_pool().connection() as connection:
+            async with connection.transaction():
+                async with connection.cursor() as cursor:
+                    await execute(
+                        cursor,
+                        "update_user",
+                        {**dict.fromkeys(USER_COLUMNS), **updates, "current": username},
                     )
-                return True
+                    await publish(cursor, "user", username)
+        evict("user", username)
+        return True
     except:
         return False
 
 
 async def delete_user(username: str) -> bool:
-    connection = await psycopg.AsyncConnection.connect(
-        secrets.POSTGRES_URI, autocommit=True
-    )
     try:
-        async with connection:
-            async with connection.cursor() as cursor:
-                await cursor.execute(
-                    "DELETE FROM t_users WHERE username = %s", (username,)
-                )
-                return True
+        async with get_pool().connection() as connection:
+            async with connection.transaction():
+                async with connection.cursor() as cursor:
+                    # The cascade removes the user's follows, votes and
+                    # comments without touching the counters they were in
+                    for name, statement in (
+                        (
+                            "uncount_follows",
+                            """UPDATE user_counters SET followers = followers - 1
+                            WHERE username IN (
+                                SELECT following FROM follows WHERE username = %s
+                            )""",
+                        ),
+                        (
+                            "uncount_followers",
+                            """UPDATE user_counters SET following = following - 1
+                            WHERE username IN (
+                                SELECT username FROM follows WHERE following = %s
+                            )""",
+                        ),
+                        (
+                            "uncount_votes",
+                            """UPDATE post_counters SET votes = votes - voted.count
+                            FROM (
+                                SELECT id, COUNT(*) FROM votes
+                                WHERE username = %s GROUP BY id
+                            ) AS voted
+                            WHERE post_counters.post_id = voted.id""",
+                        ),
+                        (
+                            "uncount_comments",
+                            """UPDATE post_counters
+                            SET comments = comments - commented.count
+                            FROM (
+                                SELECT post_id, COUNT(*) FROM comments
+                                WHERE username = %s GROUP BY post_id
+                            ) AS commented
+                            WHERE post_counters.post_id = commented.post_id""",
+                        ),
+                    ):
+                        await execute(cursor, name, (username,), query=statement)
+                    await execute(
+                        cursor,
+                        "delete_user",
+                        (username,),
+                        query="DELETE FROM t_users WHERE username = %s",
+                    )
+                    await publish(cursor, "user", username)
+        evict("user", username)
+        return True
     except:
         return False
 
 
 async def read_avatar(username: str) -> str | None:
     """Fetch user avatar URL for displaying on user profile"""
-    connection = await psycopg.AsyncConnection.connect(
-        secrets.POSTGRES_URI, autocommit=True
-    )
     try:
-        async with connection:
+        async with get_pool().connection() as connection:
             async with connection.cursor() as cursor:
-                await cursor.execute(
-                    "SELECT url FROM avatars WHERE username = %s", (username,)
-                )
+                await execute(cursor, "read_avatar", (username,))
                 url = await cursor.fetchone()
                 return url[0]
     except:
         return None
 
 
+async def read_avatars(usernames: List[str]) -> Dict[str, str]:
+    """Fetch the avatar URLs of multiple users in a single query"""
+    try:
+        async with get_pool().connection() as connection:
+            async with connection.cursor() as cursor:
+                await execute(cursor, "read_avatars", (list(usernames),))
+                return dict(await cursor.fetchall())
+    except:
+        return {}
+
+
 async def update_avatar(username: str, url: str) -> bool:
     """Update user avatar URL"""
-    connection = await psycopg.AsyncConnection.connect(
-        secrets.POSTGRES_URI, autocommit=True
-    )
     try:
-        async with connection:
-            async with connection.cursor() as cursor:
-                await cursor.execute(
-                    """INSERT INTO avatars (username, url)
-                    VALUES (%s, %s)
-                    ON CONFLICT (username) DO UPDATE
-                    SET url = EXCLUDED.url""",
-                    (username, url),
-                )
-                return True
+        async with get_pool().connection() as connection:
+            async with connection.transaction():
+                async with connection.cursor() as cursor:
+                    await execute(
+                        cursor,
+                        "update_avatar",
+                        (username, url),
+                        query="""INSERT INTO avatars (username, url)
+                        VALUES (%s, %s)
+                        ON CONFLICT (username) DO UPDATE
+                        SET url = EXCLUDED.url""",
+                    )
+                    await publish(cursor, "user", username)
+        evict("user", username)
+        return True
     except:
         return False
 
 
-async def create_post(username: str, post: Post) -> bool:
-    connection = await psycopg.AsyncConnection.connect(
-        secrets.POSTGRES_URI, autocommit=True
+async def _add_user_counter(
+    cursor: AsyncCursor, username: str, column: str, delta: int
+):
+    """Add to one of a user's counters, within the caller's transaction"""
+    await execute(
+        cursor,
+        "add_user_counter",
+        {"username": username, "delta": delta},
+        query=sql.SQL(
+            """INSERT INTO user_counters (username, {column})
+            VALUES (%(username)s, GREATEST(%(delta)s, 0))
+            ON CONFLICT (username) DO UPDATE
+            SET {column} = GREATEST(user_counters.{column} + %(delta)s, 0)"""
+        ).format(column=sql.Identifier(column)),
+    )
+
+
+async def _add_post_counter(cursor: AsyncCursor, _id: str, column: str, delta: int):
+    """Add to one of a post's counters, within the caller's transaction"""
+    await execute(
+        cursor,
+        "add_post_counter",
+        {"id": _id, "delta": delta},
+        query=sql.SQL(
+            """INSERT INTO post_counters (post_id, {column})
+            VALUES (%(id)s, GREATEST(%(delta)s, 0))
+            ON CONFLICT (post_id) DO UPDATE
+            SET {column} = GREATEST(post_counters.{column} + %(delta)s, 0)"""
+        ).format(column=sql.Identifier(column)),
     )
+
+
+async def create_post(username: str, post: Post) -> bool:
+    """Create a post and push it to the timelines of the author's
+    followers, unless they have too many followers to push to"""
     try:
-        async with connection:
-            async with connection.cursor() as cursor:
-                await cursor.execute(
-                    "INSERT INTO posts VALUES (%s, %s, %s, %s)",
-                    (username, post.id, post.body, post.created_at),
-                )
-                return True
+        async with get_pool().connection() as connection:
+            async with connection.transaction():
+                async with connection.cursor() as cursor:
+                    await execute(
+                        cursor,
+                        "create_post",
+                        (username, post.id, post.body, post.created_at),
+                    )
+                    await _add_user_counter(cursor, username, "posts", 1)
+                    await execute(
+                        cursor,
+                        "create_post_counters",
+                        (post.id,),
+                        query="INSERT INTO post_counters (post_id) VALUES (%s)",
+                    )
+                    await execute(
+                        cursor,
+                        "read_fanout",
+                        (username, username, secrets.FANOUT_LIMIT + 1),
+                        query="""SELECT
+                            EXISTS (SELECT 1 FROM pull_authors WHERE username = %s),
+                            (SELECT COUNT(*) FROM (
+                                SELECT 1 FROM follows WHERE following = %s LIMIT %s
+                            ) AS followers)""",
+                    )
+                    pulled, followers = await cursor.fetchone()
+                    if pulled:
+                        return True
+                    if followers > secrets.FANOUT_LIMIT:
+                        await execute(
+                            cursor,
+                            "add_pull_author",
+                            (username,),
+                            query="""INSERT INTO pull_authors VALUES (%s)
+                            ON CONFLICT DO NOTHING""",
+                        )
+                        return True
+                    await execute(
+                        cursor,
+                        "fan_out_post",
+                        (post.id, username, post.created_at, username),
+                        query="""INSERT INTO timelines
+                        SELECT username, %s, %s, %s FROM follows
+                        WHERE following = %s
+                        ON CONFLICT DO NOTHING""",
+                    )
+                    return True
     except:
         return False
 
 
 async def read_post(_id: str) -> PostResponse | None:
-    connection = await psycopg.AsyncConnection.connect(
-        secrets.POSTGRES_URI, autocommit=True
-    )
     try:
-        async with connection:
+        async with get_pool().connection() as connection:
             async with connection.cursor() as cursor:
-                await cursor.execute("SELECT * FROM posts WHERE id = %s", (_id,))
+                await execute(cursor, "read_post", (_id,))
                 result = await cursor.fetchone()
-                fields = list(PostResponse.__fields__.keys())
-                post = PostResponse(
-                    **{key: result[index] for index, key in enumerate(fields[:-1])}
-                )
-                post.created_at = post.created_at.strftime("%d %B %Y, %H:%M:%S")
-                return post
+                return PostResponse(*result) if result else None
     except:
         return None
 
 
-async def read_post_count(username: str) -> int:
-    """Fetch the total number of posts made by a user"""
-    connection = await psycopg.AsyncConnection.connect(
-        secrets.POSTGRES_URI, autocommit=True
-    )
+async def read_posts(ids: List[str]) -> List[PostResponse]:
+    """Fetch multiple posts along with their author's avatar in a single
+    query, keeping the order of the given ids"""
+    if not ids:
+        return []
     try:
-        async with connection:
+        async with get_pool().connection() as connection:
             async with connection.cursor() as cursor:
-                await cursor.execute(
-                    "SELECT COUNT(*) FROM posts WHERE username = %s", (username,)
-                )
-                result = await cursor.fetchone()
-                return result[0]
+                await execute(cursor, "read_posts", (list(ids),))
+                posts = {
+                    post.id: post
+                    for post in _records(PostResponse, await cursor.fetchall())
+                }
+                return [posts[_id] for _id in ids if _id in posts]
     except:
-        return 0
+        return []
 
 
-async def read_recent_posts(username: str, limit: int = 5) -> List[PostResponse]:
-    """Get data of recent posts made by a user for showing on user profile"""
-    connection = await psycopg.AsyncConnection.connect(
-        secrets.POSTGRES_URI, autocommit=True
-    )
+async def read_trending_posts(username: str, ids: List[str]) -> List[PostResponse]:
+    """Fetch the given posts in their order, leaving out the ones made by
+    the user or recommended to them"""
+    if not ids:
+        return []
     try:
-        async with connection:
+        async with get_pool().connection() as connection:
             async with connection.cursor() as cursor:
-                await cursor.execute(
-                    """SELECT * FROM posts WHERE username = %s
-                ORDER BY created_at DESC
-                LIMIT %s""",
-                    (username, limit),
+                await execute(
+                    cursor,
+                    "read_trending_posts",
+                    {"ids": list(ids), "username": username},
                 )
-                results = await cursor.fetchall()
-                fields = list(PostResponse.__fields__.keys())
-                posts = []
-                for data in results:
-                    post = PostResponse(
-                        **{key: data[index] for index, key in enumerate(fields[:-1])}
-                    )
-                    post.created_at = post.created_at.strftime("%d %B %Y, %H:%M:%S")
-                    posts.append(post)
-                return posts
+                posts = {
+                    post.id: post
+                    for post in _records(PostResponse, await cursor.fetchall())
+                }
+                return [posts[_id] for _id in ids if _id in posts]
     except:
         return []
 
 
-async def read_feed_posts(username: str, limit: int = 10) -> List[PostResponse]:
-    """Read posts of users followed by the current user, ordered by most recent"""
-    connection = await psycopg.AsyncConnection.connect(
-        secrets.POSTGRES_URI, autocommit=True
-    )
+async def read_user_counters(username: str) -> Dict[str, int]:
+    """Fetch the post, follower and following counts of a user"""
     try:
-        async with connection:
+        async with get_pool().connection() as connection:
             async with connection.cursor() as cursor:
-                await cursor.execute(
-                    """SELECT * FROM posts WHERE username IN
-                (SELECT following FROM follows WHERE username = %s)
-                ORDER BY created_at DESC
-                LIMIT %s""",
-                    (username, limit),
+                await execute(cursor, "read_user_counters", (username,))
+                result = await cursor.fetchone() or (0, 0, 0)
+                return dict(zip(("posts", "followers", "following"), result))
+    except:
+        return {"posts": 0, "followers": 0, "following": 0}
+
+
+async def read_post_counters(_id: str) -> Dict[str, int]:
+    """Fetch the vote and comment counts of a post"""
+    try:
+        async with get_pool().connection() as connection:
+            async with connection.cursor() as cursor:
+                await execute(cursor, "read_post_counters", (_id,))
+                result = await cursor.fetchone() or (0, 0)
+                return dict(zip(("votes", "comments"), result))
+    except:
+        return {"votes": 0, "comments": 0}
+
+
+async def read_recent_posts(
+    username: str, limit: int = 5, cursor: str | None = None
+) -> Tuple[List[PostResponse], str | None]:
+    """Get a page of recent posts made by a user for showing on user profile,
+    along with the cursor of the next page"""
+    after = decode_cursor(cursor, 2)
+    try:
+        async with get_pool().connection() as connection:
+            async with connection.cursor() as cursor:
+                await execute(
+                    cursor,
+                    "read_recent_posts",
+                    {
+                        "username": username,
+                        "created_at": after and after[0],
+                        "id": after and after[1],
+                        "limit": limit + 1,
+                    },
                 )
-                results = await cursor.fetchall()
-                fields = list(PostResponse.__fields__.keys())
-                posts = []
-                for data in results:
-                    post = PostResponse(
-                        **{key: data[index] for index, key in enumerate(fields[:-1])}
-                    )
-                    post.created_at = post.created_at.strftime("%d %B %Y, %H:%M:%S")
-                    posts.append(post)
-                return posts
+                results, next_cursor = _next_page(await cursor.fetchall(), limit, 3, 1)
+                return _records(PostResponse, results), next_cursor
     except:
-        return []
+        return [], None
 
 
-async def read_explore_posts(username: str) -> List[Tuple[str, ...]]:
-    """Fetch recent 1000 posts"""
-    connection = await psycopg.AsyncConnection.connect(
-        secrets.POSTGRES_URI, autocommit=True
-    )
+async def read_feed_posts(
+    username: str, limit: int = 10, cursor: str | None = None
+) -> Tuple[List[PostResponse], str | None]:
+    """Read a page of posts of users followed by the current user, ordered
+    by most recent, along with the cursor of the next page. Posts come from
+    the user's timeline, and from the followed authors whose posts aren't
+    pushed to timelines."""
+    after = decode_cursor(cursor, 2)
     try:
-        async with connection:
+        async with get_pool().connection() as connection:
             async with connection.cursor() as cursor:
-                await cursor.execute(
-                    """SELECT id, body FROM posts
-                    WHERE username != %s
-                    ORDER BY created_at desc
-                    LIMIT 1000""",
-                    (username,),
+                await execute(
+                    cursor,
+                    "read_feed_posts",
+                    {
+                        "username": username,
+                        "created_at": after and after[0],
+                        "id": after and after[1],
+                        "limit": limit + 1,
+                    },
                 )
-                posts = await cursor.fetchall()
-                return list(posts)
+                results, next_cursor = _next_page(await cursor.fetchall(), limit, 3, 1)
+                return _records(PostResponse, results), next_cursor
     except:
-        []
+        return [], None
+
+
+async def backfill_timelines(size: int) -> bool:
+    """Fill the timelines from the followed users' posts if they are empty,
+    e.g. on databases created before timelines existed"""
+    try:
+        async with get_pool().connection() as connection:
+            async with connection.cursor() as cursor:
+                await execute(
+                    cursor,
+                    "backfill_timelines",
+                    (size,),
+                    query="""INSERT INTO timelines
+                    SELECT username, id, author, created_at FROM (
+                        SELECT follows.username, posts.id,
+                            posts.username AS author, posts.created_at,
+                            ROW_NUMBER() OVER (
+                                PARTITION BY follows.username
+                                ORDER BY posts.created_at DESC, posts.id DESC
+                            ) AS position
+                        FROM follows
+                        JOIN posts ON posts.username = follows.following
+                        WHERE NOT EXISTS (SELECT 1 FROM timelines)
+                        AND follows.following NOT IN (SELECT username FROM pull_authors)
+                    ) AS ranked
+                    WHERE position <= %s
+                    ON CONFLICT DO NOTHING""",
+                )
+                return True
+    except:
+        return False
+
+
+async def prune_timelines(size: int) -> int:
+    """Trim every timeline to its newest posts, returns the number of posts
+    removed"""
+    try:
+        async with get_pool().connection() as connection:
+            async with connection.cursor() as cursor:
+                await execute(
+                    cursor,
+                    "prune_timelines",
+                    (size,),
+                    query="""DELETE FROM timelines USING (
+                        SELECT username, post_id FROM (
+                            SELECT username, post_id, ROW_NUMBER() OVER (
+                                PARTITION BY username
+                                ORDER BY created_at DESC, post_id DESC
+                            ) AS position
+                            FROM timelines
+                        ) AS ranked
+                        WHERE position > %s
+                    ) AS old
+                    WHERE timelines.username = old.username
+                    AND timelines.post_id = old.post_id""",
+                )
+                return cursor.rowcount
+    except:
+        return 0
+
+
+async def reconcile_counters() -> int:
+    """Recount the user and post counters from their rows and repair the
+    ones that drifted, returns the number of counters repaired"""
+    try:
+        async with get_pool().connection() as connection:
+            async with connection.cursor() as cursor:
+                await execute(
+                    cursor,
+                    "reconcile_user_counters",
+                    (),
+                    query="""INSERT INTO user_counters AS counters
+                        (username, posts, followers, following)
+                    SELECT username,
+                        (SELECT COUNT(*) FROM posts
+                            WHERE posts.username = t_users.username),
+                        (SELECT COUNT(*) FROM follows
+                            WHERE follows.following = t_users.username),
+                        (SELECT COUNT(*) FROM follows
+                            WHERE follows.username = t_users.username)
+                    FROM t_users
+                    ON CONFLICT (username) DO UPDATE
+                    SET posts = EXCLUDED.posts,
+                        followers = EXCLUDED.followers,
+                        following = EXCLUDED.following
+                    WHERE (counters.posts, counters.followers, counters.following)
+                        IS DISTINCT FROM
+                        (EXCLUDED.posts, EXCLUDED.followers, EXCLUDED.following)""",
+                )
+                repaired = cursor.rowcount
+                await execute(
+                    cursor,
+                    "reconcile_post_counters",
+                    (),
+                    query="""INSERT INTO post_counters AS counters
+                        (post_id, votes, comments)
+                    SELECT id,
+                        (SELECT COUNT(*) FROM votes WHERE votes.id = posts.id),
+                        (SELECT COUNT(*) FROM comments
+                            WHERE comments.post_id = posts.id)
+                    FROM posts
+                    ON CONFLICT (post_id) DO UPDATE
+                    SET votes = EXCLUDED.votes, comments = EXCLUDED.comments
+                    WHERE (counters.votes, counters.comments)
+                        IS DISTINCT FROM (EXCLUDED.votes, EXCLUDED.comments)""",
+                )
+                return repaired + cursor.rowcount
+    except:
+        return 0
+
+
+async def read_post_corpus(
+    batch_size: int = 5000,
+) -> AsyncIterator[List[Tuple[str, ...]]]:
+    """Iterate over the id, username and body of every post in batches,
+    used for building the explore index"""
+    last_id = ""
+    while True:
+        async with get_pool().connection() as connection:
+            async with connection.cursor() as cursor:
+                await execute(
+                    cursor,
+                    "read_post_corpus",
+                    (last_id, batch_size),
+                    query="""SELECT id, username, body FROM posts
+                    WHERE id > %s
+                    ORDER BY id
+                    LIMIT %s""",
+                )
+                posts = await cursor.fetchall()
+        if not posts:
+            return
+        yield list(posts)
+        last_id = posts[-1][0]
 
 
 async def read_liked_posts(username: str) -> List[Tuple[str, ...]]:
     """Fetch last 100 posts liked by a user"""
-    connection = await psycopg.AsyncConnection.connect(
-        secrets.POSTGRES_URI, autocommit=True
-    )
     try:
-        async with connection:
+        async with get_pool().connection() as connection:
             async with connection.cursor() as cursor:
-                await cursor.execute(
-                    """SELECT id, body FROM posts WHERE id IN
+                await execute(
+                    cursor,
+                    "read_liked_posts",
+                    (username,),
+                    query="""SELECT id, body FROM posts WHERE id IN
                     (SELECT id FROM votes WHERE username = %s)
                     LIMIT 100""",
-                    (username,),
                 )
                 posts = await cursor.fetchall()
                 return list(posts)
@@ -357,205 +824,393 @@ async def read_liked_posts(username: str) -> List[Tuple[str, ...]]:
         []
 
 
+async def replace_recommendations(
+    username: str, recommended: List[Tuple[str, float]]
+) -> bool:
+    """Replace the precomputed recommendations of a user with the given
+    (post id, score) pairs"""
+    try:
+        async with get_pool().connection() as connection:
+            async with connection.transaction():
+                async with connection.cursor() as cursor:
+                    await execute(
+                        cursor,
+                        "delete_recommendations",
+                        (username,),
+                        query="DELETE FROM recommendations WHERE username = %s",
+                    )
+                    # Posts deleted since they were indexed are skipped,
+                    # the index of a worker may still hold them
+                    await execute(
+                        cursor,
+                        "insert_recommendations",
+                        (
+                            username,
+                            [_id for _id, _ in recommended],
+                            [score for _, score in recommended],
+                        ),
+                        query="""INSERT INTO recommendations
+                        SELECT %s, recommended.id, recommended.score, now()
+                        FROM unnest(%s::CHAR(32)[], %s::REAL[])
+                            AS recommended (id, score)
+                        WHERE EXISTS (
+                            SELECT 1 FROM posts WHERE posts.id = recommended.id
+                        )
+                        ON CONFLICT DO NOTHING""",
+                    )
+                    # Recorded even when nothing was recommended, so the
+                    # user is not queued again on every view
+                    await execute(
+                        cursor,
+                        "record_recommendation_run",
+                        (username,),
+                        query="""INSERT INTO recommendation_runs (username, computed_at)
+                        VALUES (%s, now())
+                        ON CONFLICT (username) DO UPDATE
+                        SET computed_at = EXCLUDED.computed_at""",
+                    )
+                    return True
+    except:
+        return False
+
+
+async def read_recommendations(
+    username: str, limit: int = 10, cursor: str | None = None
+) -> Tuple[List[PostResponse], datetime | None, str | None]:
+    """Fetch a page of the precomputed recommended posts of a user, best
+    first, along with the time they were computed at and the cursor of the
+    next page"""
+    after = decode_cursor(cursor, 2)
+    try:
+        async with get_pool().connection() as connection:
+            async with connection.cursor() as cursor:
+                await execute(
+                    cursor,
+                    "read_recommendations",
+                    {
+                        "username": username,
+                        "score": after and after[0],
+                        "id": after and after[1],
+                        "limit": limit + 1,
+                    },
+                )
+                results, next_cursor = _next_page(await cursor.fetchall(), limit, 6, 1)
+                posts = _records(PostResponse, results, 5)
+                if results:
+                    return posts, results[0][5], next_cursor
+                await execute(cursor, "read_recommendations_computed_at", (username,))
+                computed_at = await cursor.fetchone()
+                return posts, computed_at and computed_at[0], next_cursor
+    except:
+        return [], None, None
+
+
+async def claim_stale_recommendations(before: datetime, limit: int = 100) -> List[str]:
+    """Fetch users whose recommendations were computed before the given
+    time, including users with none. They are marked as computed now so
+    other workers do not claim them too."""
+    try:
+        async with get_pool().connection() as connection:
+            async with connection.cursor() as cursor:
+                await execute(
+                    cursor,
+                    "claim_stale_recommendations",
+                    (before, limit),
+                    query="""UPDATE recommendation_runs SET computed_at = now()
+                    WHERE username IN (
+                        SELECT username FROM recommendation_runs
+                        WHERE computed_at < %s
+                        LIMIT %s
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING username""",
+                )
+                users = await cursor.fetchall()
+                return [user[0] for user in users]
+    except:
+        return []
+
+
 async def delete_post(_id: str) -> bool:
-    connection = await psycopg.AsyncConnection.connect(
-        secrets.POSTGRES_URI, autocommit=True
-    )
     try:
-        async with connection:
+        async with get_pool().connection() as connection:
             async with connection.cursor() as cursor:
-                await cursor.execute("DELETE FROM posts WHERE id = %s", (_id,))
+                async with connection.transaction():
+                    await execute(
+                        cursor,
+                        "delete_post",
+                        (_id,),
+                        query="DELETE FROM posts WHERE id = %s RETURNING username",
+                    )
+                    deleted = await cursor.fetchone()
+                    if deleted:
+                        await _add_user_counter(cursor, deleted[0], "posts", -1)
                 return True
     except:
         return False
 
 
-async def toggle_follow(username: str, to_toggle: str):
-    connection = await psycopg.AsyncConnection.connect(
-        secrets.POSTGRES_URI, autocommit=True
-    )
-    async with connection:
+async def toggle_follow(username: str, to_toggle: str) -> Tuple[bool, int]:
+    """Follow or unfollow a user in a single statement, adding their recent
+    posts to the follower's timeline or removing them. Returns whether the
+    user follows them now and their follower count"""
+    async with get_pool().connection() as connection:
         async with connection.cursor() as cursor:
-            await cursor.execute(
-                "SELECT * FROM follows WHERE username = %s AND following = %s",
-                (username, to_toggle),
-            )
-            following = await cursor.fetchone()
-            if not following:
-                await cursor.execute(
-                    "INSERT INTO follows VALUES (%s, %s)", (username, to_toggle)
-                )
-                return
-            await cursor.execute(
-                "DELETE FROM follows WHERE username = %s AND following = %s",
-                (username, to_toggle),
+            await execute(
+                cursor,
+                "toggle_follow",
+                {
+                    "username": username,
+                    "following": to_toggle,
+                    "size": secrets.TIMELINE_SIZE,
+                },
             )
+            state, followers = await cursor.fetchone()
+            return state, followers
 
 
 async def follows(username: str, following: str) -> bool | None:
     """Check if a user follows another user"""
     if username == following:
         return None
-    connection = await psycopg.AsyncConnection.connect(
-        secrets.POSTGRES_URI, autocommit=True
-    )
-    async with connection:
+    async with get_pool().connection() as connection:
         async with connection.cursor() as cursor:
-            await cursor.execute(
-                "SELECT * FROM follows WHERE username = %s AND following = %s",
-                (username, following),
-            )
+            await execute(cursor, "follows", (username, following))
             following = await cursor.fetchone()
             if not following:
                 return False
             return True
 
 
-async def read_followers(username: str) -> List[str]:
-    """Fetch the followers of a user"""
-    connection = await psycopg.AsyncConnection.connect(
-        secrets.POSTGRES_URI, autocommit=True
-    )
-    async with connection:
+async def read_followers(
+    username: str, limit: int = 50, cursor: str | None = None
+) -> Tuple[List[str], str | None]:
+    """Fetch a page of the followers of a user in alphabetical order, along
+    with the cursor of the next page"""
+    after = decode_cursor(cursor, 1)
+    async with get_pool().connection() as connection:
         async with connection.cursor() as cursor:
-            await cursor.execute(
-                "SELECT username FROM follows WHERE following = %s",
-                (username,),
+            await execute(
+                cursor,
+                "read_followers",
+                (username, after and after[0], after and after[0], limit + 1),
             )
-            followers = await cursor.fetchall()
-            return list(followers)
+            followers, next_cursor = _next_page(await cursor.fetchall(), limit, 0)
+            return [row[0] for row in followers], next_cursor
 
 
-async def read_following(username: str) -> List[str]:
-    """Fetch the following of a user"""
-    connection = await psycopg.AsyncConnection.connect(
-        secrets.POSTGRES_URI, autocommit=True
-    )
-    async with connection:
+async def read_following(
+    username: str, limit: int = 50, cursor: str | None = None
+) -> Tuple[List[str], str | None]:
+    """Fetch a page of the users a user follows in alphabetical order, along
+    with the cursor of the next page"""
+    after = decode_cursor(cursor, 1)
+    async with get_pool().connection() as connection:
         async with connection.cursor() as cursor:
-            await cursor.execute(
-                "SELECT following FROM follows WHERE username = %s",
-                (username,),
+            await execute(
+                cursor,
+                "read_following",
+                (username, after and after[0], after and after[0], limit + 1),
             )
-            following = await cursor.fetchall()
-            return list(following)
+            following, next_cursor = _next_page(await cursor.fetchall(), limit, 0)
+            return [row[0] for row in following], next_cursor
 
 
-async def toggle_vote(username: str, _id: str):
-    connection = await psycopg.AsyncConnection.connect(
-        secrets.POSTGRES_URI, autocommit=True
-    )
-    async with connection:
+async def toggle_vote(username: str, _id: str) -> Tuple[bool, int]:
+    """Vote on the post or take the vote back in a single statement,
+    returns whether the user has voted on it now and its vote count"""
+    async with get_pool().connection() as connection:
         async with connection.cursor() as cursor:
-            await cursor.execute(
-                "SELECT * FROM votes WHERE username = %s AND id = %s",
-                (username, _id),
-            )
-            voted = await cursor.fetchone()
-            if not voted:
-                await cursor.execute(
-                    "INSERT INTO votes VALUES (%s, %s)", (_id, username)
+            await execute(cursor, "toggle_vote", {"username": username, "id": _id})
+            state, votes = await cursor.fetchone()
+            return state, votes
+
+
+async def flush_votes(changes: List[Tuple[str, str, bool, datetime]]):
+    """Apply a batch of buffered votes in a single statement, given as
+    (post id, username, voted, voted at). Votes on posts deleted since are
+    dropped"""
+    if not changes:
+        return
+    ids, usernames, states, times = (list(column) for column in zip(*changes))
+    async with get_pool().connection() as connection:
+        async with connection.cursor() as cursor:
+            await execute(
+                cursor,
+                "flush_votes",
+                (ids, usernames, states, times),
+                query="""WITH changes AS (
+                    SELECT * FROM unnest(
+                        %s::CHAR(32)[], %s::VARCHAR[], %s::BOOL[], %s::TIMESTAMPTZ[]
+                    ) AS changes (id, username, voted, voted_at)
+                    WHERE EXISTS (SELECT 1 FROM posts WHERE posts.id = changes.id)
+                ), unvoted AS (
+                    DELETE FROM votes USING changes
+                    WHERE NOT changes.voted
+                    AND votes.id = changes.id AND votes.username = changes.username
+                    RETURNING votes.id
+                ), voted AS (
+                    INSERT INTO votes (id, username, voted_at)
+                    SELECT id, username, voted_at FROM changes WHERE voted
+                    ON CONFLICT DO NOTHING
+                    RETURNING id
+                ), deltas AS (
+                    SELECT id, SUM(delta) AS delta FROM (
+                        SELECT id, 1 AS delta FROM voted
+                        UNION ALL SELECT id, -1 FROM unvoted
+                    ) AS changed
+                    GROUP BY id
                 )
-                return
-            await cursor.execute(
-                "DELETE FROM votes WHERE username = %s AND id = %s",
-                (username, _id),
+                INSERT INTO post_counters (post_id, votes)
+                SELECT id, GREATEST(delta, 0) FROM deltas
+                ON CONFLICT (post_id) DO UPDATE
+                SET votes = GREATEST(
+                    post_counters.votes
+                        + (SELECT delta FROM deltas WHERE id = EXCLUDED.post_id),
+                    0
+                )""",
             )
 
 
 async def voted(username: str, _id: str) -> bool:
     """Check if the user has voted on the current post"""
-    connection = await psycopg.AsyncConnection.connect(
-        secrets.POSTGRES_URI, autocommit=True
-    )
-    async with connection:
+    async with get_pool().connection() as connection:
         async with connection.cursor() as cursor:
-            await cursor.execute(
-                "SELECT * FROM votes WHERE username = %s AND id = %s",
-                (username, _id),
-            )
+            await execute(cursor, "voted", (username, _id))
             voted = await cursor.fetchone()
             if not voted:
                 return False
             return True
 
 
-async def read_votes(_id: str) -> List[str]:
-    """Fetch total count of votes on a post"""
-    connection = await psycopg.AsyncConnection.connect(
-        secrets.POSTGRES_URI, autocommit=True
-    )
+async def read_vote_count(_id: str) -> int:
+    """Fetch the number of votes on a post"""
+    return (await read_post_counters(_id))["votes"]
+
+
+async def read_votes(
+    _id: str, limit: int = 10, cursor: str | None = None
+) -> Tuple[List[str], str | None]:
+    """Fetch a page of the users who voted on a post, most recent first,
+    along with the cursor of the next page"""
+    after = decode_cursor(cursor, 2)
     try:
-        async with connection:
+        async with get_pool().connection() as connection:
             async with connection.cursor() as cursor:
-                await cursor.execute(
-                    "SELECT username FROM votes WHERE id = %s",
-                    (_id,),
+                await execute(
+                    cursor,
+                    "read_votes",
+                    {
+                        "id": _id,
+                        "voted_at": after and after[0],
+                        "username": after and after[1],
+                        "limit": limit + 1,
+                    },
                 )
-                votes = await cursor.fetchall()
-                return list(votes)
+                votes, next_cursor = _next_page(await cursor.fetchall(), limit, 1, 0)
+                return [row[0] for row in votes], next_cursor
     except:
-        []
+        return [], None
 
 
-async def create_comment(comment: Comment) -> bool:
-    connection = await psycopg.AsyncConnection.connect(
-        secrets.POSTGRES_URI, autocommit=True
-    )
+async def read_recent_votes(since: datetime) -> List[Tuple[str, str, datetime]]:
+    """Post ids, voters and times of the votes made since the given time"""
     try:
-        async with connection:
+        async with get_pool().connection() as connection:
             async with connection.cursor() as cursor:
-                await cursor.execute(
-                    """INSERT INTO comments
-                VALUES (%(post_id)s, %(id)s, %(username)s, %(body)s, %(created_at)s)""",
-                    comment.dict(),
+                await execute(
+                    cursor,
+                    "read_recent_votes",
+                    (since,),
+                    query="""SELECT id, username, voted_at FROM votes
+                    WHERE voted_at >= %s ORDER BY voted_at""",
                 )
-                return True
+                return await cursor.fetchall()
+    except:
+        return []
+
+
+async def create_comment(comment: Comment) -> bool:
+    try:
+        async with get_pool().connection() as connection:
+            async with connection.transaction():
+                async with connection.cursor() as cursor:
+                    await execute(cursor, "create_comment", comment.dict())
+                    await _add_post_counter(cursor, comment.post_id, "comments", 1)
+                    return True
     except:
         return False
 
 
-async def read_comments(_id: str, limit: int = 10) -> List[Comment]:
-    connection = await psycopg.AsyncConnection.connect(
-        secrets.POSTGRES_URI, autocommit=True
-    )
+async def read_comments(
+    _id: str, limit: int = 10, cursor: str | None = None
+) -> Tuple[List[CommentResponse], str | None]:
+    """Read a page of the comments on a post, most recent first, along with
+    the cursor of the next page"""
+    after = decode_cursor(cursor, 2)
     try:
-        async with connection:
+        async with get_pool().connection() as connection:
             async with connection.cursor() as cursor:
-                await cursor.execute(
-                    """SELECT * FROM comments WHERE post_id = %s
-                    ORDER BY created_at DESC
-                    LIMIT %s""",
-                    (_id, limit),
+                await execute(
+                    cursor,
+                    "read_comments",
+                    {
+                        "id": _id,
+                        "created_at": after and after[0],
+                        "comment_id": after and after[1],
+                        "limit": limit + 1,
+                    },
                 )
-                results = await cursor.fetchall()
-                comments = []
-                for data in results:
-                    comment = Comment(
-                        **{
-                            key: data[index]
-                            for index, key in enumerate(Comment.__fields__.keys())
-                        }
-                    )
-                    comment.created_at = comment.created_at.strftime(
-                        "%d %B %Y, %H:%M:%S"
-                    )
-                    comments.append(comment)
-                return comments
+                results, next_cursor = _next_page(await cursor.fetchall(), limit, 4, 1)
+                return _records(CommentResponse, results), next_cursor
     except:
-        []
+        return [], None
 
 
-async def delete_comment(_id: str) -> bool:
-    connection = await psycopg.AsyncConnection.connect(
-        secrets.POSTGRES_URI, autocommit=True
-    )
+async def read_recent_comments(since: datetime) -> List[Tuple[str, datetime]]:
+    """Post ids and times of the comments made since the given time"""
     try:
-        async with connection:
+        async with get_pool().connection() as connection:
             async with connection.cursor() as cursor:
-                await cursor.execute(
-                    "DELETE FROM comments WHERE comment_id = %s", (_id,)
+                await execute(
+                    cursor,
+                    "read_recent_comments",
+                    (since,),
+                    query="""SELECT post_id, created_at FROM comments
+                    WHERE created_at >= %s ORDER BY created_at""",
                 )
-                return True
+                return await cursor.fetchall()
+    except:
+        return []
+
+
+async def delete_comment(_id: str) -> bool:
+    try:
+        async with get_pool().connection() as connection:
+            async with connection.transaction():
+                async with connection.cursor() as cursor:
+                    await execute(
+                        cursor,
+                        "delete_comment",
+                        (_id,),
+                        query="""DELETE FROM comments WHERE comment_id = %s
+                        RETURNING post_id""",
+                    )
+                    deleted = await cursor.fetchone()
+                    if deleted:
+                        await _add_post_counter(cursor, deleted[0], "comments", -1)
+                    return True
     except:
         return False
+
+
+# Every public database call is timed, and counted towards the request that
+# made it
+for _name, _function in list(globals().items()):
+    if (
+        inspect.iscoroutinefunction(_function)
+        and _function.__module__ == __name__
+        and not _name.startswith("_")
+    ):
+        globals()[_name] = timed_call(_function)
+del _name, _function
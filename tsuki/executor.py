@@ -0,0 +1,165 @@
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Mapping
+
+from tsuki.config import secrets
+
+
+class ExecutorBusy(Exception):
+    """Raised when an executor's queue is full or a task times out"""
+
+
+def _timed(fn: Callable, *args) -> tuple:
+    """Run a task and report when it started and how long it ran, wall
+    clock time is used as the task may run in another process"""
+    started = time.time()
+    result = fn(*args)
+    return started, time.time() - started, result
+
+
+class ManagedExecutor:
+    """Thread or process pool with a bounded queue, per-task timeouts and
+    queue wait / run time statistics.
+
+    Args:
+        name (str): Name used when reporting statistics.
+        factory (Callable[[int], Executor]): Creates the underlying pool
+        with the given number of workers.
+        workers (int): Number of workers of the pool.
+        queue_size (int): Tasks allowed to wait for a free worker, further
+        tasks are rejected with ExecutorBusy.
+        timeout (float): Default seconds to wait for a task.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        factory: Callable[[int], Executor],
+        workers: int,
+        queue_size: int,
+        timeout: float,
+    ):
+        self.name = name
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self._factory = factory
+        self._executor: Executor | None = None
+        self._in_flight = 0
+        self._stats = {
+            "submitted": 0,
+            "completed": 0,
+            "rejected": 0,
+            "timeouts": 0,
+            "queue_wait_seconds": 0.0,
+            "queue_wait_max_seconds": 0.0,
+            "run_seconds": 0.0,
+            "run_max_seconds": 0.0,
+        }
+
+    async def run(self, fn: Callable, *args, timeout: float | None = None) -> Any:
+        """Run `fn(*args)` on the pool and wait for the result.
+
+        Raises:
+            ExecutorBusy: The queue is full or the task did not finish in
+            time. A timed out task keeps running on its worker.
+        """
+        if self._in_flight >= self.workers + self.queue_size:
+            self._stats["rejected"] += 1
+            raise ExecutorBusy(f"{self.name} executor queue is full")
+        if self._executor is None:
+            self._executor = self._factory(self.workers)
+        loop = asyncio.get_running_loop()
+        task = self._executor.submit(_timed, fn, *args)
+        self._in_flight += 1
+        # A timed out task keeps its worker until it finishes, so the count
+        # drops when the task does rather than when we stop waiting for it
+        task.add_done_callback(lambda _: self._release(loop))
+        self._stats["submitted"] += 1
+        submitted = time.time()
+        try:
+            started, elapsed, result = await asyncio.wait_for(
+                asyncio.wrap_future(task), timeout or self.timeout
+            )
+        except asyncio.TimeoutError as exception:
+            self._stats["timeouts"] += 1
+            raise ExecutorBusy(f"{self.name} task timed out") from exception
+        waited = max(started - submitted, 0.0)
+        self._stats["completed"] += 1
+        self._stats["queue_wait_seconds"] += waited
+        self._stats["queue_wait_max_seconds"] = max(
+            self._stats["queue_wait_max_seconds"], waited
+        )
+        self._stats["run_seconds"] += elapsed
+        self._stats["run_max_seconds"] = max(self._stats["run_max_seconds"], elapsed)
+        return result
+
+    def _release(self, loop: asyncio.AbstractEventLoop):
+        """Count a task out once it is done, from the thread that finished it"""
+
+        def release():
+            self._in_flight -= 1
+
+        try:
+            loop.call_soon_threadsafe(release)
+        except RuntimeError:
+            # The loop is closed during shutdown, nothing reads the count
+            pass
+
+    def stats(self) -> Mapping[str, float]:
+        return {
+            **self._stats,
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "in_flight": self._in_flight,
+            "queued": max(self._in_flight - self.workers, 0),
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# bcrypt releases the GIL, so password hashing runs on threads
+password_executor = ManagedExecutor(
+    "password",
+    lambda workers: ThreadPoolExecutor(workers, thread_name_prefix="password"),
+    secrets.PASSWORD_WORKERS,
+    secrets.EXECUTOR_QUEUE_SIZE,
+    secrets.EXECUTOR_TIMEOUT,
+)
+# Scoring reads the in-memory post index, so it runs on threads of this
+# process rather than shipping the index to other processes
+recommend_executor = ManagedExecutor(
+    "recommend",
+    lambda workers: ThreadPoolExecutor(workers, thread_name_prefix="recommend"),
+    secrets.RECOMMEND_WORKERS,
+    secrets.EXECUTOR_QUEUE_SIZE,
+    secrets.EXECUTOR_TIMEOUT,
+)
+# Vectorizing text is stateless and holds the GIL, so it runs on separate
+# processes
+vectorize_executor = ManagedExecutor(
+    "vectorize",
+    lambda workers: ProcessPoolExecutor(
+        workers, mp_context=multiprocessing.get_context("spawn")
+    ),
+    secrets.VECTORIZE_WORKERS,
+    secrets.EXECUTOR_QUEUE_SIZE,
+    secrets.EXECUTOR_TIMEOUT,
+)
+executors = [password_executor, recommend_executor, vectorize_executor]
+
+
+def executor_stats() -> Dict[str, Mapping[str, float]]:
+    """Queue and run time statistics of every executor"""
+    return {executor.name: executor.stats() for executor in executors}
+
+
+def shutdown_executors():
+    """Stop the worker threads and processes, called from the shutdown hook"""
+    for executor in executors:
+        executor.shutdown()
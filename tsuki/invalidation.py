@@ -0,0 +1,110 @@
+import asyncio
+import logging
+from typing import Callable, Dict, List, Tuple
+
+import psycopg
+from psycopg import AsyncCursor
+
+from tsuki.config import secrets
+
+# Events are "<kind>:<key>", e.g. "user:alice"
+CHANNEL = "tsuki_invalidate"
+
+logger = logging.getLogger(__name__)
+# Evict and flush callbacks of the in-process caches, by event kind
+_subscribers: Dict[str, List[Tuple[Callable[[str], None], Callable[[], None]]]] = {}
+_listener: asyncio.Task | None = None
+
+
+def subscribe(kind: str, evict: Callable[[str], None], flush: Callable[[], None]):
+    """Register a cache for the events of a kind.
+
+    Args:
+        kind (str): Kind of the events, e.g. "user".
+        evict (Callable[[str], None]): Drops the entry of an event's key.
+        flush (Callable[[], None]): Drops every entry, called when events
+        may have been missed.
+    """
+    _subscribers.setdefault(kind, []).append((evict, flush))
+
+
+async def publish(cursor: AsyncCursor, kind: str, key: str):
+    """Tell every worker to evict a key.
+
+    Notifications are sent when the transaction of the cursor commits, so
+    other workers never reread the old row after evicting it. The writer
+    evicts its own copy with evict() once the transaction committed. Kinds
+    no cache subscribed to are not sent at all.
+
+    Args:
+        cursor (AsyncCursor): Cursor of the write that changed the key.
+        kind (str): Kind of the event.
+        key (str): Key that changed.
+    """
+    if kind not in _subscribers:
+        return
+    await cursor.execute("SELECT pg_notify(%s, %s)", (CHANNEL, f"{kind}:{key}"))
+
+
+def evict(kind: str, key: str):
+    """Evict a key from the caches of this worker, called after the write
+    that changed it committed. Evicting earlier would let a request cache
+    the old row again until the notification arrives."""
+    dispatch(f"{kind}:{key}")
+
+
+def dispatch(event: str):
+    kind, _, key = event.partition(":")
+    for evict, _ in _subscribers.get(kind, ()):
+        evict(key)
+
+
+def flush():
+    for subscribers in _subscribers.values():
+        for _, flush_ in subscribers:
+            flush_()
+
+
+async def listen():
+    """Evict the keys of the events published by every worker, on a
+    connection of its own as LISTEN holds it for the whole session"""
+    while True:
+        try:
+            # Keepalives make a dead server fail the wait for notifications
+            # instead of blocking it forever
+            async with await psycopg.AsyncConnection.connect(
+                secrets.POSTGRES_URI,
+                autocommit=True,
+                keepalives=1,
+                keepalives_idle=10,
+                keepalives_interval=5,
+                keepalives_count=3,
+            ) as connection:
+                await connection.execute(f"LISTEN {CHANNEL}")
+                # Events published while not listening are lost
+                flush()
+                async for notify in connection.notifies():
+                    dispatch(notify.payload)
+        except asyncio.CancelledError:
+            raise
+        except Exception as exception:
+            logger.warning("Invalidation listener disconnected: %s", exception)
+        await asyncio.sleep(secrets.INVALIDATION_RECONNECT_INTERVAL)
+
+
+def start_listener():
+    """Start the background listener task, called from the startup hook"""
+    global _listener
+    if _listener is None:
+        _listener = asyncio.create_task(listen())
+
+
+async def stop_listener():
+    global _listener
+    if _listener is not None:
+        _listener.cancel()
+        try:
+            await _listener
+        except asyncio.CancelledError:
+            ...
+        _listener = None
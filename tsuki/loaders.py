@@ -0,0 +1,88 @@
+import asyncio
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    List,
+    Mapping,
+    Set,
+)
+
+from fastapi import Request
+
+from tsuki.database import read_avatars
+
+
+class BatchLoader:
+    """Collects the keys requested during one event loop iteration and
+    fetches them with a single call, repeated keys are fetched only once.
+
+    Args:
+        batch (Callable[[List[Hashable]], Awaitable[Mapping]]): Fetches the
+        values of multiple keys, keys missing from the result get the
+        default.
+        default (Any): Value of keys the batch function didn't return.
+    """
+
+    def __init__(
+        self,
+        batch: Callable[[List[Hashable]], Awaitable[Mapping[Hashable, Any]]],
+        default: Any = None,
+    ):
+        self._batch = batch
+        self._default = default
+        self._futures: Dict[Hashable, asyncio.Future] = {}
+        self._queue: List[Hashable] = []
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def load(self, key: Hashable) -> Any:
+        future = self._futures.get(key)
+        if future is None:
+            future = self._futures[key] = asyncio.get_running_loop().create_future()
+            if not self._queue:
+                # The dispatch runs after the coroutines already scheduled
+                # in this iteration got to ask for their keys
+                task = asyncio.create_task(self._dispatch())
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            self._queue.append(key)
+        return await future
+
+    async def load_many(self, keys: Iterable[Hashable]) -> List[Any]:
+        return list(await asyncio.gather(*(self.load(key) for key in keys)))
+
+    async def _dispatch(self):
+        keys, self._queue = self._queue, []
+        try:
+            values = await self._batch(keys)
+        except Exception as exception:
+            for key in keys:
+                self._futures.pop(key).set_exception(exception)
+            return
+        for key in keys:
+            self._futures[key].set_result(values.get(key, self._default))
+
+
+class Loaders:
+    """Batch loaders for per-user lookups, created once per request"""
+
+    def __init__(self):
+        self.avatar = BatchLoader(read_avatars)
+
+
+def get_loaders(request: Request) -> Loaders:
+    """Loaders of the current request, created on first use.
+
+    Args:
+        request (Request): Current request.
+
+    Returns:
+        Loaders: Loaders shared by everything rendering this request.
+    """
+    loaders = getattr(request.state, "loaders", None)
+    if loaders is None:
+        loaders = request.state.loaders = Loaders()
+    return loaders
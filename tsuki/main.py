@@ -3,36 +3,71 @@ import os
 from fastapi import Depends, FastAPI, Request, status
 from fastapi.responses import HTMLResponse
 from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
 from starlette.middleware.sessions import SessionMiddleware
 
 from tsuki.config import secrets
-from tsuki.database import initdb
+from tsuki.database import close_pool, initdb, open_pool
+from tsuki.executor import ExecutorBusy, shutdown_executors
+from tsuki.invalidation import start_listener, stop_listener
+from tsuki.maintenance import start_maintenance, stop_maintenance
+from tsuki.metrics import MetricsMiddleware
 from tsuki.models import User
+from tsuki.profiler import ProfilerMiddleware
+from tsuki.recommender import (
+    build_post_index,
+    start_recommendation_worker,
+    stop_recommendation_worker,
+)
+from tsuki.routers.admin import admin
 from tsuki.routers.auth import auth
 from tsuki.routers.explore import explore
 from tsuki.routers.feed import feed
 from tsuki.routers.post import post
 from tsuki.routers.search import search
 from tsuki.routers.user import get_current_user, user
+from tsuki.templating import create_templates
+from tsuki.trending import seed_trending
+from tsuki.votes import vote_buffer
 
 app = FastAPI(docs_url=None, redoc_url=None)
 app.add_middleware(SessionMiddleware, secret_key=secrets.SECRET_KEY)
+app.add_middleware(ProfilerMiddleware)
+# Added last so that it wraps the whole request, sessions included
+app.add_middleware(MetricsMiddleware)
 app.mount(
     "/static", StaticFiles(directory=os.path.join("tsuki", "static")), name="static"
 )
+app.include_router(admin)
 app.include_router(auth)
 app.include_router(explore)
 app.include_router(feed)
 app.include_router(post)
 app.include_router(search)
 app.include_router(user)
-templates = Jinja2Templates(directory=os.path.join("tsuki", "templates"))
+templates = create_templates(os.path.join("tsuki", "templates"))
 
 
 @app.on_event("startup")
 async def startup():
+    await open_pool()
     await initdb()
+    start_listener()
+    await build_post_index()
+    await seed_trending()
+    await start_maintenance()
+    start_recommendation_worker()
+    vote_buffer.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    # Buffered votes are written before the pool closes
+    await vote_buffer.stop()
+    await stop_recommendation_worker()
+    await stop_maintenance()
+    await stop_listener()
+    await close_pool()
+    shutdown_executors()
 
 
 @app.exception_handler(status.HTTP_400_BAD_REQUEST)
@@ -74,6 +109,20 @@ async def internal_server_error(request: Request, exception: Exception):
     )
 
 
+@app.exception_handler(ExecutorBusy)
+async def service_unavailable(request: Request, exception: Exception):
+    """Error page for when CPU heavy work cannot be scheduled in time"""
+    return templates.TemplateResponse(
+        "error.html",
+        {
+            "request": request,
+            "error": "503 Service Unavailable",
+            "message": "The server is busy, try again in a moment.",
+        },
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+    )
+
+
 @app.get("/", response_class=HTMLResponse)
 async def root(request: Request):
     """Initial home page"""
@@ -0,0 +1,49 @@
+import asyncio
+from typing import Awaitable, Callable, List
+
+from tsuki.config import secrets
+from tsuki.database import backfill_timelines, prune_timelines, reconcile_counters
+
+_jobs: List[asyncio.Task] = []
+
+
+async def periodic(interval: float, job: Callable[[], Awaitable]):
+    """Run a job every interval seconds, a failed run is retried on the
+    next one"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await job()
+        except Exception:
+            ...
+
+
+async def prune():
+    """Trim timelines back to TIMELINE_SIZE posts, posts are pushed to them
+    without checking their length"""
+    await prune_timelines(secrets.TIMELINE_SIZE)
+
+
+async def start_maintenance():
+    """Backfill empty timelines and start the background maintenance jobs,
+    called from the startup hook"""
+    await backfill_timelines(secrets.TIMELINE_SIZE)
+    if not _jobs:
+        # Counters are updated along with the rows they count, reconciling
+        # repairs whatever drifted anyway, e.g. from manual edits
+        for interval, job in (
+            (secrets.TIMELINE_PRUNE_INTERVAL, prune),
+            (secrets.COUNTER_RECONCILE_INTERVAL, reconcile_counters),
+        ):
+            _jobs.append(asyncio.create_task(periodic(interval, job)))
+
+
+async def stop_maintenance():
+    for job in _jobs:
+        job.cancel()
+    for job in _jobs:
+        try:
+            await job
+        except asyncio.CancelledError:
+            ...
+    _jobs.clear()
@@ -0,0 +1,208 @@
+import functools
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Mapping, Tuple
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Upper bounds of the histogram buckets, +Inf is implied
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CALL_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# Database calls of the request being handled, None outside of requests
+_calls: ContextVar[List[int] | None] = ContextVar("calls", default=None)
+# Scope of the request being handled, None outside of requests
+_scope: ContextVar[Scope | None] = ContextVar("scope", default=None)
+# Whether a database call is under way, calls made by other database
+# functions are timed but not counted again
+_nested: ContextVar[bool] = ContextVar("nested", default=False)
+
+
+class Histogram:
+    """Prometheus style histogram with one series per set of labels.
+
+    Args:
+        name (str): Name of the metric.
+        description (str): Help text of the metric.
+        labels (Tuple[str, ...]): Names of the labels.
+        buckets (Tuple[float, ...]): Upper bounds of the buckets.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labels: Tuple[str, ...],
+        buckets: Tuple[float, ...],
+    ):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        # Label values to per-bucket counts, the last one is +Inf, and sum
+        self._series: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *labels: str):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1][0] += value
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} histogram"
+        for values, (counts, total) in self._series.items():
+            labels = _labels(zip(self.labels, values))
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                yield f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+            yield f"{self.name}_sum{{{labels}}} {total[0]}"
+            yield f"{self.name}_count{{{labels}}} {cumulative}"
+
+
+request_latency = Histogram(
+    "tsuki_request_duration_seconds",
+    "Time taken to handle requests, by route.",
+    ("method", "route", "status"),
+    LATENCY_BUCKETS,
+)
+request_calls = Histogram(
+    "tsuki_request_database_calls",
+    "Database calls made while handling requests, by route.",
+    ("method", "route"),
+    CALL_BUCKETS,
+)
+call_latency = Histogram(
+    "tsuki_database_call_duration_seconds",
+    "Time taken by database calls, by function.",
+    ("function",),
+    LATENCY_BUCKETS,
+)
+histograms = [request_latency, request_calls, call_latency]
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: Iterable[Tuple[str, Any]]) -> str:
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in labels)
+
+
+def current_route() -> str:
+    """Path of the route handling the current request, "background" for
+    work done outside of requests"""
+    scope = _scope.get()
+    if scope is None:
+        return "background"
+    return MetricsMiddleware.route(scope)
+
+
+def timed_call(function: Callable[..., Awaitable]) -> Callable[..., Awaitable]:
+    """Wrap a database function to time its calls and count them towards
+    the request making them"""
+    name = function.__name__
+
+    @functools.wraps(function)
+    async def wrapper(*args, **kwargs):
+        if _nested.get():
+            nested = None
+        else:
+            nested = _nested.set(True)
+            calls = _calls.get()
+            if calls is not None:
+                calls[0] += 1
+        start = time.perf_counter()
+        try:
+            return await function(*args, **kwargs)
+        finally:
+            call_latency.observe(time.perf_counter() - start, name)
+            if nested is not None:
+                _nested.reset(nested)
+
+    return wrapper
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording the latency and database calls of every
+    request, labelled with the path of the route that handled it.
+
+    Args:
+        app (ASGIApp): Application to wrap.
+    """
+
+    # Endpoints of the application's routes to their paths, built on the
+    # first request once every router is included
+    _paths: Dict[Any, str] | None = None
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    @classmethod
+    def route(cls, scope: Scope) -> str:
+        if cls._paths is None:
+            cls._paths = {
+                getattr(route, "endpoint", getattr(route, "app", None)): route.path
+                for route in scope["app"].routes
+            }
+        # The router stores the matched endpoint in the scope
+        return cls._paths.get(scope.get("endpoint"), "unmatched")
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status = 500
+
+        async def send_wrapper(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        calls = [0]
+        calls_token = _calls.set(calls)
+        scope_token = _scope.set(scope)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            _calls.reset(calls_token)
+            _scope.reset(scope_token)
+            route = self.route(scope)
+            request_latency.observe(elapsed, scope["method"], route, str(status))
+            request_calls.observe(calls[0], scope["method"], route)
+
+
+def render(stats: Mapping[str, Tuple[str, Mapping[str, Mapping[str, Any]]]]) -> str:
+    """Prometheus text format of the histograms and of statistics gathered
+    elsewhere.
+
+    Args:
+        stats (Mapping[str, Tuple[str, Mapping[str, Mapping[str, Any]]]]):
+        Statistics by metric prefix, as the name of their label and the
+        statistics of every value of that label, e.g. "executor" and
+        executor_stats(). Non numeric statistics are skipped.
+
+    Returns:
+        str: Metrics in the Prometheus text format.
+    """
+    lines = []
+    for histogram in histograms:
+        lines.extend(histogram.render())
+    for prefix, (label, series) in stats.items():
+        metrics: Dict[str, List[str]] = {}
+        for value, values in series.items():
+            for key, number in values.items():
+                if not isinstance(number, (int, float)):
+                    continue
+                metrics.setdefault(f"tsuki_{prefix}_{key}", []).append(
+                    f"{{{_labels([(label, value)])}}} {float(number)}"
+                )
+        for name, samples in metrics.items():
+            lines.append(f"# TYPE {name} untyped")
+            lines.extend(name + sample for sample in samples)
+    return "\n".join(lines) + "\n"
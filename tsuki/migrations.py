@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import os
+import re
+from dataclasses import dataclass
+from typing import List
+
+from psycopg import AsyncConnection, sql
+
+MIGRATIONS_DIR = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), "resources", "migrations"
+)
+# Held while migrating so that only one worker applies migrations
+ADVISORY_LOCK = 0x7473756B69
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Migration:
+    """A numbered SQL script from the migrations directory, e.g.
+    0004_indexes.sql.
+
+    Scripts run in a transaction unless they contain a
+    `-- migration: no-transaction` line, which CREATE INDEX CONCURRENTLY
+    needs. Those run one statement at a time. A script with a
+    `-- migration: optional` line may fail without stopping startup, it is
+    then retried on the next one.
+    """
+
+    version: int
+    name: str
+    script: str
+
+    @property
+    def transactional(self) -> bool:
+        return "-- migration: no-transaction" not in self.script
+
+    @property
+    def optional(self) -> bool:
+        return "-- migration: optional" in self.script
+
+    def statements(self) -> List[str]:
+        """Statements of the script, split at semicolons ending a line"""
+        statements = re.split(r";\s*$", self.script, flags=re.MULTILINE)
+        statements = [
+            "\n".join(
+                line for line in statement.splitlines() if not line.startswith("--")
+            ).strip()
+            for statement in statements
+        ]
+        return [statement for statement in statements if statement]
+
+    def indexes(self) -> List[str]:
+        """Names of the indexes the script builds concurrently"""
+        return re.findall(
+            r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)",
+            self.script,
+        )
+
+
+def read_migrations() -> List[Migration]:
+    """Every migration in the migrations directory, ordered by version"""
+    migrations = []
+    for filename in os.listdir(MIGRATIONS_DIR):
+        match = re.fullmatch(r"(\d+)_(\w+)\.sql", filename)
+        if not match:
+            continue
+        with open(os.path.join(MIGRATIONS_DIR, filename)) as sql_file:
+            migrations.append(
+                Migration(int(match.group(1)), match.group(2), sql_file.read())
+            )
+    return sorted(migrations, key=lambda migration: migration.version)
+
+
+async def _drop_invalid_indexes(connection: AsyncConnection, names: List[str]):
+    """Drop indexes left invalid by a failed concurrent build, IF NOT EXISTS
+    would skip rebuilding them otherwise"""
+    cursor = await connection.execute(
+        """SELECT class.relname FROM pg_index
+        JOIN pg_class AS class ON class.oid = pg_index.indexrelid
+        WHERE NOT pg_index.indisvalid AND class.relname = ANY(%s)""",
+        (names,),
+    )
+    for (name,) in await cursor.fetchall():
+        await connection.execute(
+            sql.SQL("DROP INDEX CONCURRENTLY IF EXISTS {}").format(sql.Identifier(name))
+        )
+
+
+async def _apply(connection: AsyncConnection, migration: Migration):
+    record = (
+        "INSERT INTO schema_version (version, name, applied_at) VALUES (%s, %s, now())"
+    )
+    if migration.transactional:
+        async with connection.transaction():
+            await connection.execute(migration.script)
+            await connection.execute(record, (migration.version, migration.name))
+        return
+    await _drop_invalid_indexes(connection, migration.indexes())
+    for statement in migration.statements():
+        await connection.execute(statement)
+    await connection.execute(record, (migration.version, migration.name))
+
+
+async def migrate(connection: AsyncConnection) -> List[int]:
+    """Apply the migrations missing from the schema_version table, in order.
+
+    Args:
+        connection (AsyncConnection): Connection in autocommit mode, as
+        concurrent index builds can't run in a transaction.
+
+    Returns:
+        List[int]: Versions applied by this call.
+    """
+    # Poll for the lock instead of blocking on it, a session waiting in
+    # pg_advisory_lock holds a snapshot that concurrent index builds of the
+    # migrating worker would wait on in turn
+    while True:
+        cursor = await connection.execute(
+            "SELECT pg_try_advisory_lock(%s)", (ADVISORY_LOCK,)
+        )
+        if (await cursor.fetchone())[0]:
+            break
+        await asyncio.sleep(0.5)
+    try:
+        await connection.execute(
+            """CREATE TABLE IF NOT EXISTS schema_version (
+                version     INT             PRIMARY KEY,
+                name        TEXT            NOT NULL,
+                applied_at  TIMESTAMPTZ     NOT NULL
+            )"""
+        )
+        cursor = await connection.execute("SELECT version FROM schema_version")
+        applied = {version for (version,) in await cursor.fetchall()}
+        versions = []
+        for migration in read_migrations():
+            if migration.version in applied:
+                continue
+            try:
+                await _apply(connection, migration)
+            except Exception as exception:
+                if not migration.optional:
+                    raise
+                logger.warning(
+                    "Skipped optional migration %04d_%s: %s",
+                    migration.version,
+                    migration.name,
+                    exception,
+                )
+                continue
+            versions.append(migration.version)
+        return versions
+    finally:
+        await connection.execute("SELECT pg_advisory_unlock(%s)", (ADVISORY_LOCK,))
@@ -1,3 +1,4 @@
+from dataclasses import dataclass
 from datetime import datetime
 from typing import Optional
 
@@ -12,13 +13,37 @@ class User(BaseModel):
     created_at: datetime
 
 
+# Records read from the database are built positionally from rows, in
+# column order, without validation. Times are formatted by the templates.
+
+
+@dataclass(slots=True)
+class UserRecord:
+    email: str
+    username: str
+    password: str
+    verified: bool
+    created_at: datetime
+
+
+@dataclass(slots=True)
+class UserSearchResult:
+    username: str
+    avatar: Optional[str] = None
+    posts: int = 0
+    followers: int = 0
+    following: int = 0
+    follows: Optional[bool] = None
+
+
 class Post(BaseModel):
     body: str
     id: str
     created_at: datetime
 
 
-class PostResponse(BaseModel):
+@dataclass(slots=True)
+class PostResponse:
     username: str
     id: str
     body: str
@@ -34,10 +59,11 @@ class Comment(BaseModel):
     created_at: datetime
 
 
-class CommentResponse(BaseModel):
+@dataclass(slots=True)
+class CommentResponse:
     post_id: str
     id: str
     username: str
     body: str
-    created_at: str
+    created_at: datetime
     self_: bool = False
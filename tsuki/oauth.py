@@ -1,11 +1,44 @@
+import hmac
+from dataclasses import replace
 from datetime import datetime
 
-from fastapi import Request
+from fastapi import HTTPException, Request, status
 from jose import jwt
+from passlib.context import CryptContext
 
+from tsuki.cache import MISSING, token_cache, user_cache
 from tsuki.config import secrets
 from tsuki.database import *
-from tsuki.models import User
+from tsuki.executor import password_executor
+from tsuki.models import UserRecord
+
+password_ctx = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+async def hash_password(password: str) -> str:
+    """Hash a password with bcrypt on the password executor, so that the
+    event loop is not blocked.
+
+    Args:
+        password (str): Plain text password.
+
+    Returns:
+        str: bcrypt hash of the password.
+    """
+    return await password_executor.run(password_ctx.hash, password)
+
+
+async def verify_password(password: str, hashed: str) -> bool:
+    """Check a password against its bcrypt hash on the password executor.
+
+    Args:
+        password (str): Plain text password.
+        hashed (str): bcrypt hash to check against.
+
+    Returns:
+        bool: True if the password matches.
+    """
+    return await password_executor.run(password_ctx.verify, password, hashed)
 
 
 def create_access_token(username: str):
@@ -26,25 +59,66 @@ def create_access_token(username: str):
     return token
 
 
-async def get_current_user(request: Request) -> User | None:
+async def get_current_user(request: Request) -> UserRecord | None:
     """Get the current logged in user using the Authorization token.
 
     Args:
         request (Request): FastAPI request.
 
     Returns:
-        User | None: Returns the username of authorized user if any
+        UserRecord | None: Returns the username of authorized user if any
         else None.
     """
+    # Resolved once per request, routes may call this more than once
+    user = getattr(request.state, "user", MISSING)
+    if user is not MISSING:
+        return user
     try:
         token: str = request.session["Authorization"]
-        payload = jwt.decode(token, secrets.SECRET_KEY, algorithms=["HS256"])
-        username: str = payload.get("user")
+        username = token_cache.get(token)
+        if username is MISSING:
+            payload = jwt.decode(token, secrets.SECRET_KEY, algorithms=["HS256"])
+            username = payload.get("user")
+            token_cache.set(token, username)
         if not username:
             return None
     except:
         return None
-    user = await read_user(username)
-    if not user:
-        return None
-    return user
+    user = user_cache.get(username)
+    if user is MISSING:
+        user = await read_user(username)
+        # Unknown users are not cached, the username may be taken later
+        if user:
+            user_cache.set(username, user)
+    # Routes may change the user they get, the cached one is kept as read
+    request.state.user = replace(user) if user else None
+    return request.state.user
+
+
+def is_admin(authorization: str) -> bool:
+    """Check an Authorization header against the admin token, no header is
+    an admin one while the token is not configured.
+
+    Args:
+        authorization (str): Value of the Authorization header.
+
+    Returns:
+        bool: Whether the header bears the admin token.
+    """
+    return bool(secrets.ADMIN_TOKEN) and hmac.compare_digest(
+        authorization.encode(), f"Bearer {secrets.ADMIN_TOKEN}".encode()
+    )
+
+
+def require_admin(request: Request):
+    """Allow only requests bearing the admin token to internal endpoints,
+    which are hidden altogether while no token is configured.
+
+    Args:
+        request (Request): FastAPI request.
+
+    Raises:
+        HTTPException: 404 when the token is missing or wrong.
+    """
+    if not is_admin(request.headers.get("Authorization", "")):
+        raise HTTPException(status.HTTP_404_NOT_FOUND)
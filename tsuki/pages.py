@@ -0,0 +1,54 @@
+import asyncio
+import time
+from collections import defaultdict
+from typing import Any, Awaitable, Dict, Mapping, Tuple
+
+# Per page: loads, queries run, wall time of the loads and the time the
+# queries would have taken one after another
+_stats: Dict[str, Dict[str, float]] = defaultdict(
+    lambda: {
+        "loads": 0,
+        "queries": 0,
+        "wall_seconds": 0.0,
+        "wall_max_seconds": 0.0,
+        "serial_seconds": 0.0,
+    }
+)
+
+
+async def _timed(query: Awaitable) -> Tuple[Any, float]:
+    start = time.perf_counter()
+    result = await query
+    return result, time.perf_counter() - start
+
+
+async def load_page(page: str, **queries: Awaitable) -> Dict[str, Any]:
+    """Run the independent queries of a page concurrently, each on its own
+    pooled connection, and record how long they took.
+
+    A page view holds as many connections as it has queries, five for the
+    post and profile pages, so the pool serves POOL_MAX_SIZE / 5 views at
+    a time before they wait for connections.
+
+    Args:
+        page (str): Name of the page in the statistics.
+        **queries (Awaitable): Queries of the page by name.
+
+    Returns:
+        Dict[str, Any]: Results of the queries by name.
+    """
+    start = time.perf_counter()
+    results = await asyncio.gather(*(_timed(query) for query in queries.values()))
+    wall = time.perf_counter() - start
+    stats = _stats[page]
+    stats["loads"] += 1
+    stats["queries"] += len(queries)
+    stats["wall_seconds"] += wall
+    stats["wall_max_seconds"] = max(stats["wall_max_seconds"], wall)
+    stats["serial_seconds"] += sum(elapsed for _, elapsed in results)
+    return {name: result for name, (result, _) in zip(queries, results)}
+
+
+def page_stats() -> Dict[str, Mapping[str, float]]:
+    """Query counts and load times of every page"""
+    return {page: dict(stats) for page, stats in _stats.items()}
@@ -0,0 +1,220 @@
+import asyncio
+import os
+import sys
+import threading
+from collections import Counter, OrderedDict
+from contextvars import ContextVar
+from types import FrameType
+from typing import Any, Iterable, List, Set, Tuple
+from uuid import uuid4
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from tsuki.oauth import is_admin
+
+# Seconds between samples, and the number of profiles kept
+SAMPLE_INTERVAL = 0.001
+PROFILES_KEPT = 10
+# Header asking for the request to be profiled, along with the admin token
+HEADER = b"x-profile"
+
+# Profile of the request being handled, set only in the profiled request
+_profile: ContextVar["Profile | None"] = ContextVar("profile", default=None)
+# Collapsed stacks of the last profiles, by id
+_profiles: "OrderedDict[str, str]" = OrderedDict()
+_active = False
+
+
+def _frame_name(frame: FrameType) -> str:
+    code = frame.f_code
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return f"{module}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+def _thread_stack(frame: FrameType | None) -> List[FrameType]:
+    """Frames of a thread's stack, outermost first"""
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+    return frames[::-1]
+
+
+def _await_chain(task: asyncio.Task) -> Tuple[List[FrameType], Any]:
+    """Frames of the coroutines a suspended task is awaiting, outermost
+    first, and the future at the end of the chain"""
+    frames = []
+    awaitable: Any = task.get_coro()
+    while awaitable is not None:
+        frame = getattr(awaitable, "cr_frame", None) or getattr(
+            awaitable, "gi_frame", None
+        )
+        if frame is None:
+            break
+        frames.append(frame)
+        awaitable = getattr(awaitable, "cr_await", None) or getattr(
+            awaitable, "gi_yieldfrom", None
+        )
+    return frames, awaitable
+
+
+def _in(frames: Iterable[FrameType], *modules: str) -> bool:
+    return any(
+        module in frame.f_code.co_filename for frame in frames for module in modules
+    )
+
+
+class Profile:
+    """Sampling profile of a single request, in the collapsed stack format
+    flame graph tools read.
+
+    A thread samples the event loop and the executor threads. Stacks are
+    rooted by what the request was doing:
+
+        cpu:render     running on the event loop, rendering a template
+        cpu:loop       running on the event loop, anything else
+        cpu:<executor> running on a thread of the executor, e.g. bcrypt on
+                       password or scoring on recommend
+        wait:database  waiting for a query, the awaiting coroutines follow
+        wait:executor  waiting for an executor, e.g. vectorizing
+        wait:other     waiting for anything else
+        loop:busy      the event loop was running other requests' work
+
+    Samples of the loop only count towards the request while it runs the
+    request's own tasks, the ones created while handling it included.
+    Waiting tasks are each sampled, so concurrent waits add up.
+
+    Args:
+        loop (asyncio.AbstractEventLoop): Loop handling the request.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.id = uuid4().hex
+        self.loop = loop
+        self.tasks: Set[asyncio.Task] = set()
+        self.samples: Counter = Counter()
+        self._loop_thread = threading.get_ident()
+        self._previous_factory = loop.get_task_factory()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(
+            target=self._sample_until_stopped, name="profiler", daemon=True
+        )
+
+    def _task_factory(self, loop, coro, **kwargs) -> asyncio.Task:
+        task = asyncio.Task(coro, loop=loop, **kwargs)
+        # Called in the context of the code creating the task
+        if _profile.get() is self:
+            self.tasks.add(task)
+        return task
+
+    def start(self):
+        self.tasks.add(asyncio.current_task())
+        self.loop.set_task_factory(self._task_factory)
+        self._sampler.start()
+
+    def stop(self) -> str:
+        """Stop sampling and return the profile in the collapsed stack
+        format"""
+        self._stop.set()
+        self._sampler.join()
+        self.loop.set_task_factory(self._previous_factory)
+        return "".join(
+            f"{stack} {count}\n" for stack, count in self.samples.most_common()
+        )
+
+    def _record(self, root: str, frames: Iterable[FrameType]):
+        self.samples[";".join([root, *map(_frame_name, frames)])] += 1
+
+    def _sample(self):
+        threads = sys._current_frames()
+        for thread in threading.enumerate():
+            prefix, _, _ = thread.name.partition("_")
+            if prefix not in ("password", "recommend"):
+                continue
+            frames = _thread_stack(threads.get(thread.ident))
+            # Busy workers run their task through executor._timed
+            if _in(frames, os.path.join("tsuki", "executor.py")):
+                self._record(f"cpu:{prefix}", frames)
+        running = asyncio.current_task(self.loop)
+        if running in self.tasks:
+            frames = _thread_stack(threads.get(self._loop_thread))
+            root = "cpu:render" if _in(frames, "jinja2") else "cpu:loop"
+            self._record(root, frames)
+            return
+        if running is not None:
+            self._record("loop:busy", ())
+            return
+        for task in list(self.tasks):
+            if task.done():
+                continue
+            frames, awaited = _await_chain(task)
+            if _in(frames, "psycopg", os.path.join("tsuki", "database.py")):
+                self._record("wait:database", frames)
+            elif _in(frames, os.path.join("tsuki", "executor.py")):
+                self._record("wait:executor", frames)
+            # Tasks waiting for their child tasks are left out, the
+            # children are sampled instead
+            elif not isinstance(awaited, asyncio.Task) and (
+                type(awaited).__name__ != "_GatheringFuture"
+            ):
+                self._record("wait:other", frames)
+
+    def _sample_until_stopped(self):
+        while not self._stop.wait(SAMPLE_INTERVAL):
+            try:
+                self._sample()
+            except Exception:
+                # Stacks change under the sampler, a failed sample is
+                # skipped
+                ...
+
+
+def read_profile(profile_id: str) -> str | None:
+    """Collapsed stacks of one of the last profiles"""
+    return _profiles.get(profile_id)
+
+
+class ProfilerMiddleware:
+    """ASGI middleware profiling the requests that send the X-Profile
+    header along with the admin token. The profile's id is returned in the
+    X-Profile-Id response header. Other requests only pay for looking for
+    the header.
+
+    Args:
+        app (ASGIApp): Application to wrap.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        global _active
+        if scope["type"] != "http" or _active:
+            return await self.app(scope, receive, send)
+        if not any(name == HEADER for name, _ in scope["headers"]):
+            return await self.app(scope, receive, send)
+        headers = dict(scope["headers"])
+        if not is_admin(headers.get(b"authorization", b"").decode("latin-1")):
+            return await self.app(scope, receive, send)
+        # One request is profiled at a time, as the task factory is shared
+        _active = True
+        profile = Profile(asyncio.get_running_loop())
+
+        async def send_wrapper(message: Message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [
+                    *message.get("headers", []),
+                    (b"x-profile-id", profile.id.encode()),
+                ]
+            await send(message)
+
+        token = _profile.set(profile)
+        profile.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _profile.reset(token)
+            _profiles[profile.id] = profile.stop()
+            while len(_profiles) > PROFILES_KEPT:
+                _profiles.popitem(last=False)
+            _active = False
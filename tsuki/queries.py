@@ -0,0 +1,245 @@
+import time
+from collections import defaultdict
+from typing import Any, Dict, Mapping, Sequence
+
+from psycopg import AsyncCursor, sql
+
+from tsuki.slowlog import slow_queries
+
+# Statements run on every page load or toggle, by name. They are prepared
+# on a pooled connection the first time they run on it, so Postgres parses
+# and plans each of them once per connection. Columns are listed instead of
+# "*", a prepared statement fails once its table gains a column.
+QUERIES: Dict[str, str] = {
+    "read_short_url": "SELECT token FROM shorturl WHERE id = %s",
+    "read_user": """SELECT email, username, password, verified, created_at
+        FROM t_users WHERE username = %s""",
+    # Columns not being changed are passed as NULL and keep their value
+    "update_user": """UPDATE t_users SET
+        email = COALESCE(%(email)s, email),
+        username = COALESCE(%(username)s, username),
+        password = COALESCE(%(password)s, password),
+        verified = COALESCE(%(verified)s, verified)
+        WHERE username = %(current)s""",
+    "read_avatar": "SELECT url FROM avatars WHERE username = %s",
+    "read_avatars": "SELECT username, url FROM avatars WHERE username = ANY(%s)",
+    "create_post": "INSERT INTO posts VALUES (%s, %s, %s, %s)",
+    "read_post": "SELECT username, id, body, created_at FROM posts WHERE id = %s",
+    "read_posts": """SELECT posts.username, posts.id, posts.body, posts.created_at,
+            avatars.url
+        FROM posts
+        LEFT JOIN avatars ON avatars.username = posts.username
+        WHERE posts.id = ANY(%s)""",
+    "read_trending_posts": """SELECT posts.username, posts.id, posts.body,
+            posts.created_at, avatars.url
+        FROM posts
+        LEFT JOIN avatars ON avatars.username = posts.username
+        WHERE posts.id = ANY(%(ids)s) AND posts.username <> %(username)s
+        AND NOT EXISTS (
+            SELECT 1 FROM recommendations
+            WHERE recommendations.username = %(username)s
+            AND recommendations.post_id = posts.id
+        )""",
+    "read_user_counters": """SELECT posts, followers, following FROM user_counters
+        WHERE username = %s""",
+    "read_post_counters": """SELECT votes, comments FROM post_counters
+        WHERE post_id = %s""",
+    "read_recent_posts": """SELECT username, id, body, created_at FROM posts
+        WHERE username = %(username)s
+        AND (%(created_at)s::TIMESTAMPTZ IS NULL
+            OR (created_at, id) < (%(created_at)s, %(id)s))
+        ORDER BY created_at DESC, id DESC
+        LIMIT %(limit)s""",
+    "read_feed_posts": """SELECT posts.username, posts.id, posts.body,
+            posts.created_at
+        FROM (
+            (
+                SELECT post_id, created_at FROM timelines
+                WHERE username = %(username)s
+                AND (%(created_at)s::TIMESTAMPTZ IS NULL
+                    OR (created_at, post_id) < (%(created_at)s, %(id)s))
+                ORDER BY created_at DESC, post_id DESC
+                LIMIT %(limit)s
+            )
+            UNION
+            (
+                SELECT pulled.id, pulled.created_at FROM follows
+                JOIN pull_authors ON pull_authors.username = follows.following
+                CROSS JOIN LATERAL (
+                    SELECT id, created_at FROM posts
+                    WHERE posts.username = follows.following
+                    AND (%(created_at)s::TIMESTAMPTZ IS NULL
+                        OR (created_at, id) < (%(created_at)s, %(id)s))
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT %(limit)s
+                ) AS pulled
+                WHERE follows.username = %(username)s
+            )
+        ) AS page
+        JOIN posts ON posts.id = page.post_id
+        ORDER BY page.created_at DESC, page.post_id DESC
+        LIMIT %(limit)s""",
+    "read_recommendations": """SELECT posts.username, posts.id, posts.body,
+            posts.created_at, avatars.url, recommendation_runs.computed_at,
+            recommendations.score
+        FROM recommendations
+        JOIN recommendation_runs
+            ON recommendation_runs.username = recommendations.username
+        JOIN posts ON posts.id = recommendations.post_id
+        LEFT JOIN avatars ON avatars.username = posts.username
+        WHERE recommendations.username = %(username)s
+        AND (%(score)s::REAL IS NULL
+            OR (recommendations.score, recommendations.post_id)
+                < (%(score)s, %(id)s))
+        ORDER BY recommendations.score DESC, recommendations.post_id DESC
+        LIMIT %(limit)s""",
+    "read_recommendations_computed_at": """SELECT computed_at
+        FROM recommendation_runs WHERE username = %s""",
+    # A concurrent follow makes the insert a no-op, the follow it conflicted
+    # with is the state returned then
+    "toggle_follow": """WITH unfollowed AS (
+            DELETE FROM follows
+            WHERE username = %(username)s AND following = %(following)s
+            RETURNING 1
+        ), followed AS (
+            INSERT INTO follows (username, following)
+            SELECT %(username)s, %(following)s
+            WHERE NOT EXISTS (SELECT 1 FROM unfollowed)
+            ON CONFLICT DO NOTHING
+            RETURNING 1
+        ), change AS (
+            SELECT (SELECT COUNT(*) FROM followed)
+                - (SELECT COUNT(*) FROM unfollowed) AS delta
+        ), following_count AS (
+            INSERT INTO user_counters (username, following)
+            SELECT %(username)s, GREATEST(delta, 0) FROM change
+            ON CONFLICT (username) DO UPDATE
+            SET following = GREATEST(
+                user_counters.following + (SELECT delta FROM change), 0
+            )
+        ), follower_count AS (
+            INSERT INTO user_counters (username, followers)
+            SELECT %(following)s, GREATEST(delta, 0) FROM change
+            ON CONFLICT (username) DO UPDATE
+            SET followers = GREATEST(
+                user_counters.followers + (SELECT delta FROM change), 0
+            )
+            RETURNING followers
+        ), backfilled AS (
+            INSERT INTO timelines
+            SELECT %(username)s, id, username, created_at FROM posts
+            WHERE username = %(following)s
+            AND EXISTS (SELECT 1 FROM followed)
+            AND NOT EXISTS (
+                SELECT 1 FROM pull_authors WHERE username = %(following)s
+            )
+            ORDER BY created_at DESC, id DESC
+            LIMIT %(size)s
+            ON CONFLICT DO NOTHING
+        ), removed AS (
+            DELETE FROM timelines
+            WHERE username = %(username)s AND author = %(following)s
+            AND EXISTS (SELECT 1 FROM unfollowed)
+        )
+        SELECT NOT EXISTS (SELECT 1 FROM unfollowed),
+            (SELECT followers FROM follower_count)""",
+    "follows": "SELECT 1 FROM follows WHERE username = %s AND following = %s",
+    "read_followers": """SELECT username FROM follows
+        WHERE following = %s AND (%s::VARCHAR IS NULL OR username > %s)
+        ORDER BY username LIMIT %s""",
+    "read_following": """SELECT following FROM follows
+        WHERE username = %s AND (%s::VARCHAR IS NULL OR following > %s)
+        ORDER BY following LIMIT %s""",
+    # A concurrent vote makes the insert a no-op, the vote it conflicted
+    # with is the state returned then
+    "toggle_vote": """WITH unvoted AS (
+            DELETE FROM votes WHERE username = %(username)s AND id = %(id)s
+            RETURNING 1
+        ), voted AS (
+            INSERT INTO votes (id, username, voted_at)
+            SELECT %(id)s, %(username)s, now()
+            WHERE NOT EXISTS (SELECT 1 FROM unvoted)
+            ON CONFLICT DO NOTHING
+            RETURNING 1
+        ), change AS (
+            SELECT (SELECT COUNT(*) FROM voted)
+                - (SELECT COUNT(*) FROM unvoted) AS delta
+        ), vote_count AS (
+            INSERT INTO post_counters (post_id, votes)
+            SELECT %(id)s, GREATEST(delta, 0) FROM change
+            ON CONFLICT (post_id) DO UPDATE
+            SET votes = GREATEST(
+                post_counters.votes + (SELECT delta FROM change), 0
+            )
+            RETURNING votes
+        )
+        SELECT NOT EXISTS (SELECT 1 FROM unvoted),
+            (SELECT votes FROM vote_count)""",
+    "voted": "SELECT 1 FROM votes WHERE username = %s AND id = %s",
+    "read_votes": """SELECT username, voted_at FROM votes WHERE id = %(id)s
+        AND (%(voted_at)s::TIMESTAMPTZ IS NULL
+            OR (voted_at, username) < (%(voted_at)s, %(username)s))
+        ORDER BY voted_at DESC, username DESC
+        LIMIT %(limit)s""",
+    "create_comment": """INSERT INTO comments
+        VALUES (%(post_id)s, %(id)s, %(username)s, %(body)s, %(created_at)s)""",
+    "read_comments": """SELECT post_id, comment_id, username, body, created_at
+        FROM comments WHERE post_id = %(id)s
+        AND (%(created_at)s::TIMESTAMPTZ IS NULL
+            OR (created_at, comment_id) < (%(created_at)s, %(comment_id)s))
+        ORDER BY created_at DESC, comment_id DESC
+        LIMIT %(limit)s""",
+}
+
+# Per statement: executions, and their total and longest time
+_stats: Dict[str, Dict[str, float]] = defaultdict(
+    lambda: {"calls": 0, "seconds": 0.0, "max_seconds": 0.0}
+)
+
+
+async def execute(
+    cursor: AsyncCursor,
+    name: str,
+    params: Sequence[Any] | Mapping[str, Any] = (),
+    query: str | sql.Composable | None = None,
+) -> AsyncCursor:
+    """Run a statement of the catalog, preparing it on the cursor's
+    connection the first time it runs there. Statements slower than the
+    slow query threshold are logged.
+
+    Args:
+        cursor (AsyncCursor): Cursor to run the statement on.
+        name (str): Name of the statement in QUERIES, or of the query given.
+        params (Sequence[Any] | Mapping[str, Any]): Parameters of the statement.
+        query (str | sql.Composable | None): Statement run instead of one of
+        the catalog, e.g. a background one or one built at run time. Variants
+        built at run time are prepared separately.
+
+    Returns:
+        AsyncCursor: The cursor, for fetching the results.
+    """
+    query = QUERIES[name] if query is None else query
+    start = time.perf_counter()
+    try:
+        return await cursor.execute(query, params, prepare=True)
+    finally:
+        elapsed = time.perf_counter() - start
+        stats = _stats[name]
+        stats["calls"] += 1
+        stats["seconds"] += elapsed
+        stats["max_seconds"] = max(stats["max_seconds"], elapsed)
+        if elapsed >= slow_queries.threshold:
+            if not isinstance(query, str):
+                query = query.as_string(cursor)
+            slow_queries.observe(name, query, params, elapsed)
+
+
+def query_stats() -> Dict[str, Mapping[str, float]]:
+    """Execution counts and times of the catalog's statements, the ones
+    taking the most time in total first"""
+    return {
+        name: dict(stats)
+        for name, stats in sorted(
+            _stats.items(), key=lambda item: item[1]["seconds"], reverse=True
+        )
+    }
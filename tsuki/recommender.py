@@ -0,0 +1,386 @@
+import asyncio
+import threading
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Dict, Iterable, List, Set, Tuple
+
+import numpy
+from scipy import sparse
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.preprocessing import normalize
+
+from tsuki.config import secrets
+from tsuki.database import (
+    claim_stale_recommendations,
+    read_liked_posts,
+    read_post_corpus,
+    replace_recommendations,
+)
+from tsuki.executor import recommend_executor, vectorize_executor
+
+N_FEATURES = 2**20
+# Pending rows are merged into the main matrix once there are this many,
+# or once they make up this fraction of the index, whichever is larger
+COMPACT_PENDING = 256
+COMPACT_PENDING_FRACTION = 0.05
+# Deleted rows are dropped from the matrix once they make up this fraction
+COMPACT_DELETED = 0.25
+
+
+@lru_cache
+def _vectorizer(n_features: int) -> HashingVectorizer:
+    return HashingVectorizer(
+        analyzer="word",
+        ngram_range=(1, 3),
+        stop_words="english",
+        alternate_sign=False,
+        norm=None,
+        n_features=n_features,
+    )
+
+
+def count_terms(bodies: List[str], n_features: int = N_FEATURES) -> sparse.csr_matrix:
+    """Term counts of the given texts. A module level function so that it
+    can be sent to the vectorize process pool."""
+    return _vectorizer(n_features).transform(bodies)
+
+
+class PostIndex:
+    """Long-lived TF-IDF index over the body of every post.
+
+    Posts are vectorized with a stateless hashing vectorizer, so the index
+    never has to be refit. Document frequencies are maintained
+    incrementally; a post is weighted with the IDF known at the time it is
+    added and the query side always uses the current IDF.
+
+    Writes happen on the event loop while queries run on the recommend
+    executor. Queries only hold the lock to take a snapshot of the index;
+    writes never modify a matrix in place, they replace it.
+    """
+
+    def __init__(self, n_features: int = N_FEATURES):
+        self.n_features = n_features
+        self._lock = threading.Lock()
+        self._df = numpy.zeros(n_features, dtype=numpy.int32)
+        self._documents = 0
+        self._ids: List[str] = []
+        self._usernames: List[str] = []
+        self._positions: Dict[str, int] = {}
+        self._authors: Dict[str, Set[int]] = {}
+        self._removed: Set[int] = set()
+        self._matrix = sparse.csr_matrix((0, n_features), dtype=numpy.float64)
+        # Transpose of the matrix, kept around for scoring
+        self._matrix_t = self._matrix.T.tocsr()
+        self._pending: List[sparse.csr_matrix] = []
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def __contains__(self, _id: str) -> bool:
+        return _id in self._positions
+
+    def idf(self) -> numpy.ndarray:
+        """Smoothed inverse document frequency, same as TfidfVectorizer"""
+        return numpy.log((1 + self._documents) / (1 + self._df)) + 1
+
+    def transform(self, bodies: List[str]) -> sparse.csr_matrix:
+        """Term counts of the given texts"""
+        return count_terms(bodies, self.n_features)
+
+    def weigh(self, counts: sparse.csr_matrix) -> sparse.csr_matrix:
+        """Apply the current IDF to term counts and L2 normalize the rows"""
+        weighted = counts.astype(numpy.float64)
+        weighted.data *= self.idf()[weighted.indices]
+        return normalize(weighted, norm="l2")
+
+    def build(
+        self,
+        posts: List[Tuple[str, str, str]],
+        counts: sparse.csr_matrix | None = None,
+    ):
+        """Index an initial batch of (id, username, body) posts, computing
+        document frequencies over the whole batch first. Term counts of the
+        posts can be passed in when they were computed elsewhere."""
+        if not posts:
+            return
+        if counts is None:
+            counts = self.transform([body for _, _, body in posts])
+        with self._lock:
+            self._df += numpy.bincount(
+                counts.indices, minlength=self.n_features
+            ).astype(numpy.int32)
+            self._documents += len(posts)
+            for _id, username, _ in posts:
+                self._append(_id, username)
+            self._pending = [*self._pending, self.weigh(counts)]
+            self._compact()
+
+    def add(self, _id: str, username: str, body: str):
+        """Index a newly created post"""
+        if _id in self._positions:
+            return
+        counts = self.transform([body])
+        with self._lock:
+            self._df[counts.indices] += 1
+            self._documents += 1
+            self._append(_id, username)
+            self._pending = [*self._pending, self.weigh(counts)]
+            if len(self._pending) >= max(
+                COMPACT_PENDING, COMPACT_PENDING_FRACTION * len(self._ids)
+            ):
+                self._compact()
+
+    def remove(self, _id: str):
+        """Remove a deleted post from the index"""
+        with self._lock:
+            position = self._positions.pop(_id, None)
+            if position is None:
+                return
+            row = self._row(position)
+            self._df[row.indices] -= 1
+            self._documents -= 1
+            self._removed = self._removed | {position}
+            self._authors[self._usernames[position]].discard(position)
+            if len(self._removed) > COMPACT_DELETED * len(self._ids):
+                self._compact()
+
+    def posts_by(self, username: str) -> List[str]:
+        """Ids of the indexed posts made by a user"""
+        with self._lock:
+            return [self._ids[position] for position in self._authors.get(username, ())]
+
+    def vectors(self, posts: List[Tuple[str, str]]) -> sparse.csr_matrix:
+        """Vectors for the given (id, body) posts, taken from the index when
+        the post is indexed and computed from the body otherwise"""
+        if not posts:
+            return sparse.csr_matrix((0, self.n_features), dtype=numpy.float64)
+        # Rows already in the matrix are sliced out together, the rest are
+        # stacked after them and the original order is restored at the end
+        indexed, indexed_slots, rows, slots = [], [], [], []
+        missing, missing_slots = [], []
+        with self._lock:
+            matrix = self._matrix
+            for slot, (_id, body) in enumerate(posts):
+                position = self._positions.get(_id)
+                if position is not None and position < matrix.shape[0]:
+                    indexed.append(position)
+                    indexed_slots.append(slot)
+                elif position is not None:
+                    rows.append(self._row(position))
+                    slots.append(slot)
+                else:
+                    missing.append(body)
+                    missing_slots.append(slot)
+        if missing:
+            rows.append(self.weigh(self.transform(missing)))
+            slots.extend(missing_slots)
+        stacked = sparse.vstack([matrix[indexed], *rows], format="csr")
+        return stacked[numpy.argsort(indexed_slots + slots)]
+
+    def top_k(
+        self,
+        vectors: sparse.csr_matrix,
+        k: int,
+        exclude_username: str | None = None,
+        exclude_ids: Iterable[str] = (),
+    ) -> List[Tuple[str, float]]:
+        """The k indexed posts most similar to any of the given vectors,
+        best first, as (id, score) pairs. A post's score is its highest
+        cosine similarity with any of the vectors.
+
+        Only non-zero similarities are computed and the top k are picked
+        with a partial sort, so the cost follows the number of matching
+        terms rather than the size of the index.
+        """
+        with self._lock:
+            ids = self._ids
+            matrix_t = self._matrix_t
+            pending = self._pending
+            excluded = set(self._removed)
+            excluded.update(self._authors.get(exclude_username, ()))
+            excluded.update(
+                self._positions[_id] for _id in exclude_ids if _id in self._positions
+            )
+        if not vectors.shape[0] or not ids:
+            return []
+        scores = vectors @ matrix_t
+        if pending:
+            stacked = sparse.vstack(pending, format="csr")
+            scores = sparse.hstack([scores, vectors @ stacked.T], format="csr")
+        # Highest similarity of each post over all the vectors
+        best = numpy.zeros(scores.shape[1])
+        numpy.maximum.at(best, scores.indices, scores.data)
+        positions = numpy.flatnonzero(best)
+        values = best[positions]
+        if excluded:
+            keep = ~numpy.isin(positions, numpy.fromiter(excluded, dtype=int))
+            positions, values = positions[keep], values[keep]
+        if len(values) > k:
+            top = numpy.argpartition(values, -k)[-k:]
+            positions, values = positions[top], values[top]
+        order = numpy.argsort(-values, kind="stable")
+        return [
+            (ids[position], float(value))
+            for position, value in zip(positions[order], values[order])
+        ]
+
+    def recommend(
+        self, posts: List[Tuple[str, str]], k: int, username: str
+    ) -> List[Tuple[str, float]]:
+        """The k posts most similar to the given (id, body) posts, leaving
+        out the posts themselves and the posts made by `username`"""
+        vectors = self.vectors(posts)
+        return self.top_k(vectors, k, username, [_id for _id, _ in posts])
+
+    def _append(self, _id: str, username: str):
+        position = len(self._ids)
+        self._ids.append(_id)
+        self._usernames.append(username)
+        self._positions[_id] = position
+        self._authors.setdefault(username, set()).add(position)
+
+    def _row(self, position: int) -> sparse.csr_matrix:
+        rows = self._matrix.shape[0]
+        if position < rows:
+            return self._matrix[position]
+        for pending in self._pending:
+            if position < rows + pending.shape[0]:
+                return pending[position - rows]
+            rows += pending.shape[0]
+        raise IndexError(position)
+
+    def _compact(self):
+        """Merge pending rows into the matrix and drop removed posts, the
+        caller holds the lock"""
+        rebuilt = False
+        if self._pending:
+            self._matrix = sparse.vstack([self._matrix, *self._pending], format="csr")
+            self._pending = []
+            rebuilt = True
+        if len(self._removed) > COMPACT_DELETED * len(self._ids):
+            keep = [
+                index for index in range(len(self._ids)) if index not in self._removed
+            ]
+            remap = {old: new for new, old in enumerate(keep)}
+            self._matrix = self._matrix[keep]
+            self._ids = [self._ids[index] for index in keep]
+            self._usernames = [self._usernames[index] for index in keep]
+            self._positions = {_id: index for index, _id in enumerate(self._ids)}
+            self._authors = {
+                username: {remap[index] for index in positions}
+                for username, positions in self._authors.items()
+                if positions
+            }
+            self._removed = set()
+            rebuilt = True
+        if rebuilt:
+            self._matrix_t = self._matrix.T.tocsr()
+
+
+post_index = PostIndex()
+
+
+async def build_post_index(batch_size: int = 5000):
+    """Index every post in the database, called once on startup. Batches
+    are vectorized on the vectorize executor while the next ones are read."""
+    posts, counts, batches = [], [], []
+
+    async def vectorize(batch: List[Tuple[str, ...]]):
+        return await vectorize_executor.run(
+            count_terms, [body for _, _, body in batch], post_index.n_features
+        )
+
+    async for batch in read_post_corpus(batch_size):
+        posts.extend(batch)
+        batches.append(asyncio.create_task(vectorize(batch)))
+        if len(batches) >= vectorize_executor.workers:
+            counts.extend(await asyncio.gather(*batches))
+            batches = []
+    counts.extend(await asyncio.gather(*batches))
+    if posts:
+        post_index.build(posts, sparse.vstack(counts, format="csr"))
+
+
+async def recommend(
+    posts: List[Tuple[str, str]], k: int, username: str
+) -> List[Tuple[str, float]]:
+    """Run PostIndex.recommend on the recommend executor"""
+    return await recommend_executor.run(post_index.recommend, posts, k, username)
+
+
+# Users whose recommendations should be recomputed first, in the order
+# they were marked
+_dirty: Dict[str, None] = {}
+_wakeup = asyncio.Event()
+_worker: asyncio.Task | None = None
+
+
+def mark_dirty(username: str):
+    """Queue a user's recommendations to be recomputed, e.g. after they
+    voted on a post"""
+    _dirty[username] = None
+    _wakeup.set()
+
+
+def is_stale(computed_at: datetime | None) -> bool:
+    """Check if recommendations computed at the given time are past the
+    staleness bound"""
+    if computed_at is None:
+        return True
+    age = datetime.now(timezone.utc) - computed_at
+    return age > timedelta(seconds=secrets.RECOMMEND_STALENESS)
+
+
+async def refresh_recommendations(username: str):
+    """Recompute and store the recommended posts of a user based on the
+    posts they liked"""
+    liked_posts = await read_liked_posts(username)
+    recommended = []
+    if liked_posts and len(post_index):
+        recommended = await recommend(liked_posts, secrets.RECOMMEND_COUNT, username)
+    await replace_recommendations(username, recommended)
+
+
+async def recommendation_worker():
+    """Recompute recommendations in the background, dirty users first and
+    then users whose recommendations are past the staleness bound"""
+    while True:
+        try:
+            await asyncio.wait_for(_wakeup.wait(), secrets.RECOMMEND_INTERVAL)
+        except asyncio.TimeoutError:
+            ...
+        _wakeup.clear()
+        while _dirty:
+            username = next(iter(_dirty))
+            del _dirty[username]
+            try:
+                await refresh_recommendations(username)
+            except Exception:
+                ...
+        before = datetime.now(timezone.utc) - timedelta(
+            seconds=secrets.RECOMMEND_STALENESS
+        )
+        for username in await claim_stale_recommendations(before):
+            try:
+                await refresh_recommendations(username)
+            except Exception:
+                ...
+
+
+def start_recommendation_worker():
+    """Start the background recommendation task, called from the startup
+    hook"""
+    global _worker
+    if _worker is None:
+        _worker = asyncio.create_task(recommendation_worker())
+
+
+async def stop_recommendation_worker():
+    global _worker
+    if _worker is not None:
+        _worker.cancel()
+        try:
+            await _worker
+        except asyncio.CancelledError:
+            ...
+        _worker = None
@@ -0,0 +1,23 @@
+-- Precomputed explore recommendations
+CREATE TABLE IF NOT EXISTS recommendations (
+    username    VARCHAR(32)     NOT NULL,
+    post_id     CHAR(32)        NOT NULL,
+    score       REAL            NOT NULL,
+    computed_at TIMESTAMPTZ     NOT NULL,
+    PRIMARY KEY (username, post_id),
+    CONSTRAINT fk_username
+        FOREIGN KEY(username)
+            REFERENCES t_users(username)
+            ON DELETE CASCADE
+            ON UPDATE CASCADE,
+    CONSTRAINT fk_post_id
+        FOREIGN KEY(post_id)
+            REFERENCES posts(id)
+            ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS recommendations_username_score
+    ON recommendations (username, score DESC);
+
+CREATE INDEX IF NOT EXISTS recommendations_computed_at
+    ON recommendations (computed_at);
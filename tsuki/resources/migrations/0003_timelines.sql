@@ -0,0 +1,39 @@
+-- Home timelines, the newest posts of followed users pushed on write
+CREATE TABLE IF NOT EXISTS timelines (
+    username    VARCHAR(32)     NOT NULL,
+    post_id     CHAR(32)        NOT NULL,
+    author      VARCHAR(32)     NOT NULL,
+    created_at  TIMESTAMPTZ     NOT NULL,
+    PRIMARY KEY (username, post_id),
+    CONSTRAINT fk_username
+        FOREIGN KEY(username)
+            REFERENCES t_users(username)
+            ON DELETE CASCADE
+            ON UPDATE CASCADE,
+    CONSTRAINT fk_post_id
+        FOREIGN KEY(post_id)
+            REFERENCES posts(id)
+            ON DELETE CASCADE,
+    CONSTRAINT fk_author
+        FOREIGN KEY(author)
+            REFERENCES t_users(username)
+            ON DELETE CASCADE
+            ON UPDATE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS timelines_username_created_at
+    ON timelines (username, created_at DESC, post_id DESC);
+
+CREATE INDEX IF NOT EXISTS timelines_username_author
+    ON timelines (username, author);
+
+-- Authors with too many followers to push posts to, their posts are
+-- pulled into the feeds of their followers when read
+CREATE TABLE IF NOT EXISTS pull_authors (
+    username    VARCHAR(32)     PRIMARY KEY,
+    CONSTRAINT fk_username
+        FOREIGN KEY(username)
+            REFERENCES t_users(username)
+            ON DELETE CASCADE
+            ON UPDATE CASCADE
+);
@@ -0,0 +1,17 @@
+-- migration: no-transaction
+-- Indexes for the hot queries, built without blocking writes to the
+-- tables of a live database
+
+-- Profile and feed pages, read newest first by (created_at, id)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS posts_username_created_at
+    ON posts (username, created_at DESC, id DESC);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS comments_post_id_created_at
+    ON comments (post_id, created_at DESC, comment_id DESC);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS follows_following
+    ON follows (following);
+
+-- Prefix searches for type-ahead, matching and ordering by this index
+CREATE INDEX CONCURRENTLY IF NOT EXISTS t_users_username_pattern
+    ON t_users (username text_pattern_ops);
@@ -0,0 +1,10 @@
+-- migration: no-transaction
+-- migration: optional
+-- Substring and similarity username searches. Databases without pg_trgm
+-- skip this migration and retry it on the next startup, those searches
+-- scan t_users meanwhile
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS t_users_username_trigram
+    ON t_users USING GIN (username gin_trgm_ops);
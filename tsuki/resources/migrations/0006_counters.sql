@@ -0,0 +1,38 @@
+-- Counts kept up to date by the writes that change them, so that profiles,
+-- searches and posts don't count rows on every view
+CREATE TABLE IF NOT EXISTS user_counters (
+    username    VARCHAR(32)     PRIMARY KEY,
+    posts       INT             NOT NULL DEFAULT 0,
+    followers   INT             NOT NULL DEFAULT 0,
+    following   INT             NOT NULL DEFAULT 0,
+    CONSTRAINT fk_username
+        FOREIGN KEY(username)
+            REFERENCES t_users(username)
+            ON DELETE CASCADE
+            ON UPDATE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS post_counters (
+    post_id     CHAR(32)        PRIMARY KEY,
+    votes       INT             NOT NULL DEFAULT 0,
+    comments    INT             NOT NULL DEFAULT 0,
+    CONSTRAINT fk_post_id
+        FOREIGN KEY(post_id)
+            REFERENCES posts(id)
+            ON DELETE CASCADE
+);
+
+INSERT INTO user_counters (username, posts, followers, following)
+SELECT username,
+    (SELECT COUNT(*) FROM posts WHERE posts.username = t_users.username),
+    (SELECT COUNT(*) FROM follows WHERE follows.following = t_users.username),
+    (SELECT COUNT(*) FROM follows WHERE follows.username = t_users.username)
+FROM t_users
+ON CONFLICT DO NOTHING;
+
+INSERT INTO post_counters (post_id, votes, comments)
+SELECT id,
+    (SELECT COUNT(*) FROM votes WHERE votes.id = posts.id),
+    (SELECT COUNT(*) FROM comments WHERE comments.post_id = posts.id)
+FROM posts
+ON CONFLICT DO NOTHING;
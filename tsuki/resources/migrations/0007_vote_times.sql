@@ -0,0 +1,11 @@
+-- migration: no-transaction
+-- Voters are listed most recent first. The time of the votes made before
+-- this migration is unknown, they get the UNIX epoch so they are listed
+-- last and don't count as recent activity
+ALTER TABLE votes ADD COLUMN IF NOT EXISTS voted_at TIMESTAMPTZ NOT NULL
+    DEFAULT 'epoch';
+
+ALTER TABLE votes ALTER COLUMN voted_at SET DEFAULT now();
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS votes_id_voted_at
+    ON votes (id, voted_at DESC, username DESC);
@@ -0,0 +1,25 @@
+-- migration: no-transaction
+-- Primary keys for follows and votes, so that toggling can insert with
+-- ON CONFLICT instead of checking first. Duplicates left by concurrent
+-- toggles are removed beforehand, the counters they were counted in are
+-- repaired by the next reconciliation
+
+DELETE FROM follows AS duplicate USING follows
+WHERE duplicate.username = follows.username
+AND duplicate.following = follows.following
+AND duplicate.ctid > follows.ctid;
+
+DELETE FROM votes AS duplicate USING votes
+WHERE duplicate.id = votes.id
+AND duplicate.username = votes.username
+AND duplicate.ctid > votes.ctid;
+
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS follows_pkey
+    ON follows (username, following);
+
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS votes_pkey
+    ON votes (username, id);
+
+DO $$ BEGIN IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'follows_pkey') THEN ALTER TABLE follows ADD CONSTRAINT follows_pkey PRIMARY KEY USING INDEX follows_pkey; END IF; END $$;
+
+DO $$ BEGIN IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'votes_pkey') THEN ALTER TABLE votes ADD CONSTRAINT votes_pkey PRIMARY KEY USING INDEX votes_pkey; END IF; END $$;
@@ -0,0 +1,19 @@
+-- When the recommendations of each user were last computed, kept apart
+-- from the recommended posts so that users with none are recorded too
+CREATE TABLE IF NOT EXISTS recommendation_runs (
+    username    VARCHAR(32)     PRIMARY KEY,
+    computed_at TIMESTAMPTZ     NOT NULL,
+    CONSTRAINT fk_username
+        FOREIGN KEY(username)
+            REFERENCES t_users(username)
+            ON DELETE CASCADE
+            ON UPDATE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS recommendation_runs_computed_at
+    ON recommendation_runs (computed_at);
+
+INSERT INTO recommendation_runs (username, computed_at)
+SELECT username, MIN(computed_at) FROM recommendations
+GROUP BY username
+ON CONFLICT DO NOTHING;
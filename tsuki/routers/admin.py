@@ -0,0 +1,50 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+from tsuki.cache import cache_stats
+from tsuki.database import pool_stats
+from tsuki.executor import executor_stats
+from tsuki.metrics import render
+from tsuki.oauth import require_admin
+from tsuki.pages import page_stats
+from tsuki.profiler import read_profile
+from tsuki.queries import query_stats
+from tsuki.slowlog import slow_queries
+from tsuki.votes import vote_buffer
+
+# Internal endpoints, only reachable with the admin token
+admin = APIRouter(dependencies=[Depends(require_admin)])
+
+
+@admin.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Request, database, pool, executor and cache metrics in the
+    Prometheus text format"""
+    return render(
+        {
+            "pool": ("pool", {"default": pool_stats()}),
+            "query": ("query", query_stats()),
+            "executor": ("executor", executor_stats()),
+            "cache": ("cache", cache_stats()),
+            "page": ("page", page_stats()),
+            "vote_buffer": ("buffer", {"votes": vote_buffer.stats()}),
+            "slow_queries": ("log", {"default": slow_queries.stats()}),
+        }
+    )
+
+
+@admin.get("/admin/slow-queries", response_class=JSONResponse)
+async def slow_query_log():
+    """Most recent slow statements with their duration, route, parameter
+    types and, for a sample of them, their plan"""
+    return slow_queries.entries()
+
+
+@admin.get("/admin/profiles/{profile_id}", response_class=PlainTextResponse)
+async def profile(profile_id: str):
+    """Profile of a request made with the X-Profile header, as collapsed
+    stacks for flame graph tools"""
+    stacks = read_profile(profile_id)
+    if stacks is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND)
+    return stacks
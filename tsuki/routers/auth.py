@@ -10,11 +10,9 @@ import google.auth.transport.requests as google_auth
 import pytz
 from fastapi import APIRouter, Depends
 from fastapi.responses import HTMLResponse
-from fastapi.templating import Jinja2Templates
 from google.oauth2.credentials import Credentials
 from googleapiclient.discovery import build
 from jose import jwt
-from passlib.context import CryptContext
 from pydantic import BaseModel
 
 from tsuki.config import secrets
@@ -22,11 +20,11 @@ from tsuki.database import *
 from tsuki.models import User
 from tsuki.oauth import *
 from tsuki.routers.feed import get_user_feed
+from tsuki.templating import create_templates
 
 auth = APIRouter(prefix="/auth")
 parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-templates = Jinja2Templates(directory=os.path.join(parent_dir, "templates"))
-password_ctx = CryptContext(schemes=["bcrypt"], deprecated="auto")
+templates = create_templates(os.path.join(parent_dir, "templates"))
 
 
 class Login(BaseModel):
@@ -77,7 +75,7 @@ async def signup(request: fastapi.Request):
             },
         )
     # Hash the user's password
-    user.password = password_ctx.hash(user.password)
+    user.password = await hash_password(user.password)
     result = await create_user(user)
     if not result:
         return templates.TemplateResponse(
@@ -107,7 +105,7 @@ async def login(request: fastapi.Request):
                 "message": "User does not exist.",
             },
         )
-    if not password_ctx.verify(user.password, user_data.password):
+    if not await verify_password(user.password, user_data.password):
         return templates.TemplateResponse(
             "error.html",
             {
@@ -1,28 +1,76 @@
 import os
-from typing import List
 
-import pandas
 from fastapi import APIRouter, Depends, Request
 from fastapi.responses import HTMLResponse
-from fastapi.templating import Jinja2Templates
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import linear_kernel
 
+from tsuki.config import secrets
 from tsuki.database import *
-from tsuki.models import PostResponse, User
+from tsuki.models import User
 from tsuki.oauth import get_current_user
+from tsuki.recommender import is_stale, mark_dirty
+from tsuki.templating import create_templates
+from tsuki.trending import blend_trending
 
 explore = APIRouter(prefix="/explore")
 parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-templates = Jinja2Templates(directory=os.path.join(parent_dir, "templates"))
-limit = 10
+templates = create_templates(os.path.join(parent_dir, "templates"))
+PAGE_SIZE = 10
+
+
+async def explore_page(
+    request: Request, user: User, cursor: str | None
+) -> Mapping[str, Any]:
+    """Template context of a page of the user's explore feed, made of
+    recommended posts blended with trending ones.
+
+    Args:
+        request (Request): Current request.
+        user (User): Logged in user.
+        cursor (str | None): Cursor of the page, None for the first one.
+
+    Returns:
+        Mapping[str, Any]: Posts of the page and the cursor of the next.
+    """
+    # The cursor holds the recommendations cursor, None once they ran
+    # out, and the rank and id of the last trending post read so far
+    page = decode_cursor(cursor, 3)
+    recommendations, rank, post_id = page if page else (None, None, None)
+    after = None
+    if isinstance(rank, (int, float)) and isinstance(post_id, str):
+        after = (rank, post_id)
+    posts, next_recommendations = [], None
+    if page is None or recommendations is not None:
+        # Recommendations are precomputed in the background, a missing or
+        # stale set is queued to be recomputed and served as is meanwhile
+        slots = PAGE_SIZE - PAGE_SIZE // secrets.TRENDING_BLEND
+        posts, computed_at, next_recommendations = await read_recommendations(
+            user.username, slots, recommendations
+        )
+        if page is None and is_stale(computed_at):
+            mark_dirty(user.username)
+    # New users have nothing to base recommendations on yet, so they are
+    # shown trending posts instead. Trending posts are paged by their key
+    # in the ranking rather than by a count, which the posts left out of
+    # each page would throw off
+    posts, after, more = await blend_trending(user.username, posts, PAGE_SIZE, after)
+    next_cursor = None
+    if next_recommendations is not None or more:
+        next_cursor = encode_cursor(next_recommendations, *(after or (None, None)))
+    return {
+        "request": request,
+        "posts": posts,
+        "next_cursor": next_cursor,
+        "page_url": "/explore",
+        "fragment_url": "/explore/page",
+    }
 
 
 @explore.get("/", response_class=HTMLResponse)
 async def get_explore_feed(
-    request: Request, user: User = Depends(get_current_user), more: bool = False
+    request: Request,
+    user: User = Depends(get_current_user),
+    cursor: str | None = None,
 ):
-    global limit
     if not user:
         return templates.TemplateResponse(
             "error.html",
@@ -32,65 +80,20 @@ async def get_explore_feed(
                 "message": "User not logged in.",
             },
         )
-    if more:
-        limit += 5
-    else:
-        limit = 10
-    posts = await recommend_posts(user.username, limit)
-    for post in posts:
-        post.avatar = await read_avatar(post.username)
     return templates.TemplateResponse(
-        "explore.html", {"request": request, "posts": posts}
+        "explore.html", await explore_page(request, user, cursor)
     )
 
 
-async def recommend_posts(username: str, limit: int) -> List[PostResponse]:
-    """Get recommended posts for the current user based on their
-    likes. (Experimental)
-
-    Args:
-        username (str): User to fetch posts for.
-        limit (int): Limit of posts to fetch.
-
-    Returns:
-        List[PostResponse]: List of posts.
-    """
-    # Get recent 100 liked posts of user
-    liked_posts = await read_liked_posts(username)
-    if not liked_posts:
-        return []
-    # Get recent 1000 posts made
-    all_recent_posts = await read_explore_posts(username)
-    if not all_recent_posts:
-        return []
-    user_df = pandas.DataFrame(liked_posts, columns=["id", "body"])
-    post_df = pandas.DataFrame(all_recent_posts, columns=["id", "body"])
-    # Transform the body column in the vector form to
-    # compute similarity
-    tf = TfidfVectorizer(
-        analyzer="word", ngram_range=(1, 3), min_df=0, stop_words="english"
+# Only the posts of the next page, loaded in place by the "More" link
+@explore.get("/page", response_class=HTMLResponse)
+async def get_explore_feed_page(
+    request: Request,
+    user: User = Depends(get_current_user),
+    cursor: str | None = None,
+):
+    if not user:
+        return HTMLResponse(status_code=401)
+    return templates.TemplateResponse(
+        "partials/posts.html", await explore_page(request, user, cursor)
     )
-    matrix = tf.fit_transform(post_df["body"].values.astype("U"))
-    # Compute cosine similarity to check what all posts are
-    # of similar content on the basis of the body column
-    cosine_similarities = linear_kernel(matrix, matrix)
-    _id = post_df["id"]
-
-    indices = pandas.Series(user_df.index, index=user_df["id"])
-    posts = []
-    # Get recommended posts for each liked post
-    for data in liked_posts:
-        try:
-            index = indices[data[0]]
-            sim_scores = list(enumerate(cosine_similarities[index]))
-            sim_scores = sorted(sim_scores, key=lambda x: x[1], reverse=True)
-            sim_scores = sim_scores[1:31]
-            _indices = [i[0] for i in sim_scores]
-            recommended_ids = _id.iloc[_indices].head(limit)
-            for post_id in recommended_ids:
-                post = await read_post(post_id)
-                if post not in posts:
-                    posts.append(post)
-        except:
-            ...
-    return posts
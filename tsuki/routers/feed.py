@@ -2,23 +2,53 @@ import os
 
 from fastapi import APIRouter, Depends, Request
 from fastapi.responses import HTMLResponse
-from fastapi.templating import Jinja2Templates
 
 from tsuki.database import *
+from tsuki.loaders import get_loaders
 from tsuki.models import User
 from tsuki.oauth import get_current_user
+from tsuki.templating import create_templates
 
 feed = APIRouter(prefix="/feed")
 parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-templates = Jinja2Templates(directory=os.path.join(parent_dir, "templates"))
-limit = 10
+templates = create_templates(os.path.join(parent_dir, "templates"))
+PAGE_SIZE = 10
+
+
+async def feed_page(
+    request: Request, user: User, cursor: str | None
+) -> Mapping[str, Any]:
+    """Template context of a page of the user's feed.
+
+    Args:
+        request (Request): Current request.
+        user (User): Logged in user.
+        cursor (str | None): Cursor of the page, None for the first one.
+
+    Returns:
+        Mapping[str, Any]: Posts of the page and the cursor of the next.
+    """
+    posts, next_cursor = await read_feed_posts(user.username, PAGE_SIZE, cursor)
+    avatars = await get_loaders(request).avatar.load_many(
+        post.username for post in posts
+    )
+    for post, avatar in zip(posts, avatars):
+        post.avatar = avatar
+    return {
+        "request": request,
+        "posts": posts,
+        "next_cursor": next_cursor,
+        "page_url": "/feed",
+        "fragment_url": "/feed/page",
+    }
 
 
 @feed.get("/", response_class=HTMLResponse)
 async def get_user_feed(
-    request: Request, user: User = Depends(get_current_user), more: bool = False
+    request: Request,
+    user: User = Depends(get_current_user),
+    cursor: str | None = None,
 ):
-    global limit
     if not user:
         return templates.TemplateResponse(
             "error.html",
@@ -28,11 +58,20 @@ async def get_user_feed(
                 "message": "User not logged in.",
             },
         )
-    if more:
-        limit += 5
-    else:
-        limit = 10
-    posts = await read_feed_posts(user.username, limit)
-    for post in posts:
-        post.avatar = await read_avatar(post.username)
-    return templates.TemplateResponse("feed.html", {"request": request, "posts": posts})
+    return templates.TemplateResponse(
+        "feed.html", await feed_page(request, user, cursor)
+    )
+
+
+# Only the posts of the next page, loaded in place by the "More" link
+@feed.get("/page", response_class=HTMLResponse)
+async def get_user_feed_page(
+    request: Request,
+    user: User = Depends(get_current_user),
+    cursor: str | None = None,
+):
+    if not user:
+        return HTMLResponse(status_code=401)
+    return templates.TemplateResponse(
+        "partials/posts.html", await feed_page(request, user, cursor)
+    )
@@ -4,17 +4,22 @@ from uuid import uuid4
 
 import pytz
 from fastapi import APIRouter, Depends, Request
-from fastapi.responses import HTMLResponse
-from fastapi.templating import Jinja2Templates
+from fastapi.responses import HTMLResponse, JSONResponse
 
 from tsuki.database import *
-from tsuki.models import Comment, CommentResponse, Post, User
+from tsuki.models import Comment, Post, User
 from tsuki.oauth import get_current_user
+from tsuki.pages import load_page
+from tsuki.recommender import mark_dirty, post_index
+from tsuki.templating import create_templates
+from tsuki.trending import record_comment, record_vote, trending
+from tsuki.votes import vote_buffer
 
 post = APIRouter(prefix="/post")
 parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-templates = Jinja2Templates(directory=os.path.join(parent_dir, "templates"))
-limit = 5
+templates = create_templates(os.path.join(parent_dir, "templates"))
+COMMENTS_PAGE_SIZE = 5
+VOTERS_PAGE_SIZE = 10
 
 
 @post.get("/", response_class=HTMLResponse)
@@ -65,20 +70,79 @@ async def create_post_(request: Request, user: User = Depends(get_current_user))
                 "message": "Unable to create the post, please try again later.",
             },
         )
+    post_index.add(post_data.id, user.username, post_data.body)
     return await get_post(post_data.id, request, user)
 
 
+async def comments_page(
+    _id: str, request: Request, user: User | None, cursor: str | None
+) -> Mapping[str, Any]:
+    """Template context of a page of the comments on a post.
+
+    Args:
+        _id (str): ID of the post.
+        request (Request): Current request.
+        user (User | None): Logged in user, whose comments can be deleted.
+        cursor (str | None): Cursor of the page, None for the first one.
+
+    Returns:
+        Mapping[str, Any]: Comments of the page and the cursor of the next.
+    """
+    comments, next_cursor = await read_comments(_id, COMMENTS_PAGE_SIZE, cursor)
+    if user is not None:
+        for comment in comments:
+            comment.self_ = comment.username == user.username
+    return {
+        "request": request,
+        "post_id": _id,
+        "comments": comments,
+        "next_cursor": next_cursor,
+        "page_url": f"/post/{_id}",
+        "fragment_url": f"/post/{_id}/comments",
+    }
+
+
+async def voters_page(
+    _id: str, request: Request, cursor: str | None
+) -> Mapping[str, Any]:
+    """Template context of a page of the users who voted on a post.
+
+    Args:
+        _id (str): ID of the post.
+        request (Request): Current request.
+        cursor (str | None): Cursor of the page, None for the first one.
+
+    Returns:
+        Mapping[str, Any]: Voters of the page and the cursor of the next.
+    """
+    voters, next_cursor = await read_votes(_id, VOTERS_PAGE_SIZE, cursor)
+    return {
+        "request": request,
+        "users": voters,
+        "next_cursor": next_cursor,
+        "page_url": f"/post/{_id}/votes",
+        "fragment_url": f"/post/{_id}/votes",
+    }
+
+
 @post.get("/{_id}", response_class=HTMLResponse)
 async def get_post(
     _id: str,
     request: Request,
     user: User = Depends(get_current_user),
-    more: bool = False,
+    cursor: str | None = None,
 ):
-    global limit
-    post = await read_post(_id)
-    post.avatar = await read_avatar(post.username)
-    if not post:
+    page = await load_page(
+        "post",
+        # The post along with its author's avatar
+        posts=read_posts([_id]),
+        comments=comments_page(_id, request, user, cursor),
+        counters=read_post_counters(_id),
+        # The first voters only, the modal loads the rest page by page
+        voters=voters_page(_id, request, None),
+        **({"voted": vote_buffer.voted(user.username, _id)} if user else {}),
+    )
+    if not page["posts"]:
         return templates.TemplateResponse(
             "error.html",
             {
@@ -87,29 +151,47 @@ async def get_post(
                 "message": "Post not found or doesn't exist.",
             },
         )
-    if more:
-        limit += 5
-    else:
-        limit = 5
-    comments = await read_comments(_id, limit)
-    if user is not None:
-        for index in range(len(comments)):
-            comments[index] = CommentResponse(**comments[index].dict())
-            if comments[index].username == user.username:
-                comments[index].self_ = True
+    post = page["posts"][0]
+    counters = page["counters"]
+    counters["votes"] = max(counters["votes"] + vote_buffer.delta(_id), 0)
     return templates.TemplateResponse(
         "get_post.html",
         {
-            "request": request,
+            **page["comments"],
             "post": post,
             "_self": True if user and (user.username == post.username) else False,
-            "voted": await voted(user.username, _id) if user else None,
-            "voters": await read_votes(_id),
-            "comments": comments,
+            "voted": page.get("voted"),
+            "counters": counters,
+            "voters": page["voters"],
         },
     )
 
 
+# Only the comments of the next page, loaded in place by the "More" link
+@post.get("/{_id}/comments", response_class=HTMLResponse)
+async def get_comments_page(
+    _id: str,
+    request: Request,
+    user: User = Depends(get_current_user),
+    cursor: str | None = None,
+):
+    return templates.TemplateResponse(
+        "partials/comments.html", await comments_page(_id, request, user, cursor)
+    )
+
+
+@post.get("/{_id}/votes", response_class=HTMLResponse)
+async def get_voters_page(_id: str, request: Request, cursor: str | None = None):
+    return templates.TemplateResponse(
+        "partials/usernames.html", await voters_page(_id, request, cursor)
+    )
+
+
+@post.get("/{_id}/votes/count", response_class=JSONResponse)
+async def get_vote_count(_id: str):
+    return {"votes": await vote_buffer.count(_id)}
+
+
 @post.get("/{_id}/delete")
 async def delete_post_(
     _id: str, request: Request, user: User = Depends(get_current_user)
@@ -134,6 +216,8 @@ async def delete_post_(
             },
         )
     await delete_post(_id)
+    post_index.remove(_id)
+    trending.remove(_id)
     return templates.TemplateResponse(
         "response.html", {"request": request, "message": "Post deleted."}
     )
@@ -152,7 +236,9 @@ async def toggle_vote_(
                 "message": "User not logged in.",
             },
         )
-    await toggle_vote(user.username, _id)
+    voted_, _ = await vote_buffer.toggle(user.username, _id)
+    record_vote(_id, user.username, voted_)
+    mark_dirty(user.username)
     return await get_post(_id, request, user)
 
 
@@ -185,6 +271,7 @@ async def create_comment_(
                 "message": "Unable to add the comment, please try again later.",
             },
         )
+    record_comment(_id)
     return await get_post(_id, request, user)
 
 
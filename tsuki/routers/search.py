@@ -1,22 +1,57 @@
 import os
 
 from fastapi import APIRouter, Depends, Request
-from fastapi.responses import HTMLResponse
-from fastapi.templating import Jinja2Templates
+from fastapi.responses import HTMLResponse, JSONResponse
 
 from tsuki.database import *
 from tsuki.models import User
 from tsuki.oauth import get_current_user
+from tsuki.templating import create_templates
 
 search = APIRouter(prefix="/search")
 parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-templates = Jinja2Templates(directory=os.path.join(parent_dir, "templates"))
-limit = 10
+templates = create_templates(os.path.join(parent_dir, "templates"))
+PAGE_SIZE = 10
+
+
+async def search_page(
+    request: Request, user: User | None, cursor: str | None
+) -> Mapping[str, Any]:
+    """Template context of a page of results for the search term and mode
+    stored in the session.
+
+    Args:
+        request (Request): Current request.
+        user (User | None): Logged in user, to tell whom they follow.
+        cursor (str | None): Cursor of the page, None for the first one.
+
+    Returns:
+        Mapping[str, Any]: Users of the page and the cursor of the next.
+    """
+    mode = request.session.get("search_mode", "substring")
+    users, next_cursor = await search_users(
+        request.session.get("search", ""),
+        user.username if user else None,
+        PAGE_SIZE,
+        mode,
+        cursor,
+    )
+    return {
+        "request": request,
+        "mode": mode,
+        "users": users,
+        "next_cursor": next_cursor,
+        "page_url": "/search/load-more",
+        "fragment_url": "/search/page",
+    }
 
 
 @search.get("/", response_class=HTMLResponse)
 async def search_user_html(request: Request):
-    return templates.TemplateResponse("search.html", {"request": request})
+    return templates.TemplateResponse(
+        "search.html",
+        {"request": request, "mode": request.session.get("search_mode", "substring")},
+    )
 
 
 @search.post("/", response_class=HTMLResponse)
@@ -25,56 +60,44 @@ async def search_user(request: Request, user: User = Depends(get_current_user)):
     # Set a search cookie for use in toggle follow function
     if form.get("search"):
         request.session["search"] = form["search"]
-    users = await read_users(request.session["search"])
-    if not users:
-        return templates.TemplateResponse("search.html", {"request": request})
-    for index, _user in enumerate(users):
-        user_data = _user.dict()
-        del user_data["email"]
-        del user_data["password"]
-        followers = await read_followers(user_data["username"])
-        following = await read_following(user_data["username"])
-        user_data["avatar"] = await read_avatar(user_data["username"])
-        user_data["posts"] = await read_post_count(user_data["username"])
-        user_data["followers"] = len(followers)
-        user_data["following"] = len(following)
-        user_data["follows"] = (
-            await follows(user.username, user_data["username"]) if user else None
-        )
-        users[index] = user_data
+    if form.get("mode") in SEARCH_MODES:
+        request.session["search_mode"] = form["mode"]
     return templates.TemplateResponse(
-        "search.html", {"request": request, "users": users}
+        "search.html", await search_page(request, user, None)
     )
 
 
+# Type-ahead suggestions shown under the search box, matching the start of
+# usernames only so that the prefix index answers them
+@search.get("/suggest", response_class=JSONResponse)
+async def suggest_users(q: str = "", limit: int = 10):
+    if not q:
+        return []
+    users = await read_users(q, min(limit, 20), "prefix")
+    return [_user.username for _user in users]
+
+
 # A different GET endpoint to load more users.
 @search.get("/load-more", response_class=HTMLResponse)
-async def load_more_user(request: Request, user: User = Depends(get_current_user)):
-    global limit
-    form = await request.form()
-    # Set a search cookie for use in toggle follow function
-    if form.get("search"):
-        request.session["search"] = form["search"]
-    limit += 5
-    users = await read_users(request.session["search"], limit)
-    if not users:
-        return templates.TemplateResponse("search.html", {"request": request})
-    for index, _user in enumerate(users):
-        user_data = _user.dict()
-        del user_data["email"]
-        del user_data["password"]
-        followers = await read_followers(user_data["username"])
-        following = await read_following(user_data["username"])
-        user_data["avatar"] = await read_avatar(user_data["username"])
-        user_data["posts"] = await read_post_count(user_data["username"])
-        user_data["followers"] = len(followers)
-        user_data["following"] = len(following)
-        user_data["follows"] = (
-            await follows(user.username, user_data["username"]) if user else None
-        )
-        users[index] = user_data
+async def load_more_user(
+    request: Request,
+    user: User = Depends(get_current_user),
+    cursor: str | None = None,
+):
+    return templates.TemplateResponse(
+        "search.html", await search_page(request, user, cursor)
+    )
+
+
+# Only the users of the next page, loaded in place by the "More" link
+@search.get("/page", response_class=HTMLResponse)
+async def search_user_page(
+    request: Request,
+    user: User = Depends(get_current_user),
+    cursor: str | None = None,
+):
     return templates.TemplateResponse(
-        "search.html", {"request": request, "users": users}
+        "partials/users.html", await search_page(request, user, cursor)
     )
 
 
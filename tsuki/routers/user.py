@@ -1,28 +1,55 @@
 import base64
 import os
+from dataclasses import asdict
 
 import requests
 from fastapi import APIRouter, Depends, File, Request, UploadFile
 from fastapi.responses import HTMLResponse
-from fastapi.templating import Jinja2Templates
-from passlib.context import CryptContext
 
 from tsuki.database import *
 from tsuki.models import User
 from tsuki.oauth import *
+from tsuki.pages import load_page
+from tsuki.recommender import post_index
+from tsuki.templating import create_templates
+from tsuki.trending import trending
 
 user = APIRouter(prefix="/user")
 parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-templates = Jinja2Templates(directory=os.path.join(parent_dir, "templates"))
-password_ctx = CryptContext(schemes=["bcrypt"], deprecated="auto")
-limit = 5
+templates = create_templates(os.path.join(parent_dir, "templates"))
+POSTS_PAGE_SIZE = 5
+FOLLOWS_PAGE_SIZE = 50
+
+
+async def posts_page(
+    username: str, request: Request, cursor: str | None
+) -> Mapping[str, Any]:
+    """Template context of a page of the posts made by a user.
+
+    Args:
+        username (str): Author of the posts.
+        request (Request): Current request.
+        cursor (str | None): Cursor of the page, None for the first one.
+
+    Returns:
+        Mapping[str, Any]: Posts of the page and the cursor of the next.
+    """
+    posts, next_cursor = await read_recent_posts(username, POSTS_PAGE_SIZE, cursor)
+    return {
+        "request": request,
+        "posts": posts,
+        "next_cursor": next_cursor,
+        "page_url": f"/user/{username}",
+        "fragment_url": f"/user/{username}/posts",
+    }
 
 
 @user.get("/", response_class=HTMLResponse)
 async def get_user(
-    request: Request, user: User = Depends(get_current_user), more: bool = False
+    request: Request,
+    user: User = Depends(get_current_user),
+    cursor: str | None = None,
 ):
-    global limit
     if not user:
         return templates.TemplateResponse(
             "error.html",
@@ -32,23 +59,25 @@ async def get_user(
                 "message": "User not logged in.",
             },
         )
-    user_data = user.dict()
+    page = await load_page(
+        "profile",
+        counters=read_user_counters(user.username),
+        posts=posts_page(user.username, request, cursor),
+        avatar=read_avatar(user.username),
+    )
+    user_data = asdict(user)
     del user_data["password"]
-    if more:
-        limit += 5
-    else:
-        limit = 5
-    user_data["posts"] = await read_post_count(user.username)
+    counters = page["counters"]
+    user_data["posts"] = counters["posts"]
     return templates.TemplateResponse(
         "user.html",
         {
-            "request": request,
+            **page["posts"],
             "user_data": user_data,
-            "avatar": await read_avatar(user.username),
+            "avatar": page["avatar"],
             "settings": True,
-            "posts": await read_recent_posts(user.username, limit),
-            "followers": await read_followers(user.username),
-            "following": await read_following(user.username),
+            "followers": counters["followers"],
+            "following": counters["following"],
         },
     )
 
@@ -58,12 +87,21 @@ async def get_user_by_name(
     username: str,
     request: Request,
     user: User = Depends(get_current_user),
-    more: bool = False,
+    cursor: str | None = None,
 ):
-    global limit
     if user and username == user.username:
-        return await get_user(request, user)
-    _user = await read_user(username)
+        return await get_user(request, user, cursor)
+    # The user is read along with the rest, not found is rare
+    page = await load_page(
+        "user",
+        user=read_user(username),
+        counters=read_user_counters(username),
+        posts=posts_page(username, request, cursor),
+        avatar=read_avatar(username),
+        # Check if the logged in user follows the searched user
+        **({"follows": follows(user.username, username)} if user else {}),
+    )
+    _user = page["user"]
     if not _user:
         return templates.TemplateResponse(
             "error.html",
@@ -73,26 +111,67 @@ async def get_user_by_name(
                 "message": "User not found.",
             },
         )
-    user_data = _user.dict()
+    user_data = asdict(_user)
     del user_data["email"]
     del user_data["password"]
-    if more:
-        limit += 5
-    else:
-        limit = 5
-    user_data["posts"] = await read_post_count(username)
+    counters = page["counters"]
+    user_data["posts"] = counters["posts"]
     return templates.TemplateResponse(
         "user.html",
         {
-            "request": request,
+            **page["posts"],
             "user_data": user_data,
-            "avatar": await read_avatar(username),
+            "avatar": page["avatar"],
             "settings": False,
-            "posts": await read_recent_posts(username, limit),
-            # Check if the logged in user follows the searched user
-            "follows": await follows(user.username, username) if user else None,
-            "followers": await read_followers(username),
-            "following": await read_following(username),
+            "follows": page.get("follows"),
+            "followers": counters["followers"],
+            "following": counters["following"],
+        },
+    )
+
+
+# Only the posts of the next page, loaded in place by the "More" link
+@user.get("/{username}/posts", response_class=HTMLResponse)
+async def get_user_posts_page(
+    username: str, request: Request, cursor: str | None = None
+):
+    return templates.TemplateResponse(
+        "partials/profile_posts.html", await posts_page(username, request, cursor)
+    )
+
+
+# A page of the followers or following of a user, loaded when its list is
+# opened on the profile
+@user.get("/{username}/followers", response_class=HTMLResponse)
+async def get_followers_page(
+    username: str, request: Request, cursor: str | None = None
+):
+    users, next_cursor = await read_followers(username, FOLLOWS_PAGE_SIZE, cursor)
+    return templates.TemplateResponse(
+        "partials/usernames.html",
+        {
+            "request": request,
+            "users": users,
+            "next_cursor": next_cursor,
+            "page_url": f"/user/{username}/followers",
+            "fragment_url": f"/user/{username}/followers",
+        },
+    )
+
+
+@user.get("/{username}/following", response_class=HTMLResponse)
+async def get_following_page(
+    username: str, request: Request, cursor: str | None = None
+):
+    users, next_cursor = await read_following(username, FOLLOWS_PAGE_SIZE, cursor)
+    return templates.TemplateResponse(
+        "partials/usernames.html",
+        {
+            "request": request,
+            "users": users,
+            "next_cursor": next_cursor,
+            "page_url": f"/user/{username}/following",
+            "fragment_url": f"/user/{username}/following",
         },
     )
 
@@ -156,7 +235,7 @@ async def update_user_password(
     request: Request, user: User = Depends(get_current_user)
 ):
     form = await request.form()
-    if password_ctx.verify(form["password"], user.password):
+    if await verify_password(form["password"], user.password):
         return templates.TemplateResponse(
             "error.html",
             {
@@ -165,7 +244,7 @@ async def update_user_password(
                 "message": "New password cannot be the same as the original.",
             },
         )
-    password = password_ctx.hash(form["password"])
+    password = await hash_password(form["password"])
     result = await update_user(user.username, {"password": password})
     if not result:
         return templates.TemplateResponse(
@@ -274,7 +353,7 @@ async def delete_user_(request: Request, user: User = Depends(get_current_user))
             },
         )
     form = await request.form()
-    if not password_ctx.verify(form["password"], user.password):
+    if not await verify_password(form["password"], user.password):
         return templates.TemplateResponse(
             "error.html",
             {
@@ -293,6 +372,11 @@ async def delete_user_(request: Request, user: User = Depends(get_current_user))
                 "message": "Unable to delete account, try again later.",
             },
         )
+    # The cascade deleted the user's posts, they are no longer recommended
+    # or ranked
+    for _id in post_index.posts_by(user.username):
+        post_index.remove(_id)
+        trending.remove(_id)
     del request.session["Authorization"]
     return templates.TemplateResponse(
         "response.html",
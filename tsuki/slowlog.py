@@ -0,0 +1,142 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Mapping, Sequence
+
+from psycopg import AsyncConnection, errors
+
+from tsuki.config import secrets
+from tsuki.metrics import current_route
+
+logger = logging.getLogger(__name__)
+
+
+def params_shape(params: Sequence[Any] | Mapping[str, Any]) -> Any:
+    """Types of the parameters of a statement without their values, lists
+    with their length"""
+
+    def shape(value: Any) -> str:
+        if isinstance(value, (list, tuple)):
+            return f"{type(value).__name__}[{len(value)}]"
+        return type(value).__name__
+
+    if isinstance(params, Mapping):
+        return {key: shape(value) for key, value in params.items()}
+    return [shape(value) for value in params]
+
+
+class SlowQueryLog:
+    """Log of the statements slower than a threshold, keeping the most
+    recent ones along with a sample of their plans.
+
+    Plans are captured in the background on another pooled connection with
+    EXPLAIN (ANALYZE, BUFFERS) in a read only transaction that is rolled
+    back. Statements that write are explained without ANALYZE, as a read
+    only transaction cannot run them. One plan is captured at a time, slow
+    statements sampled while one is under way are not explained.
+
+    Args:
+        threshold (float): Seconds a statement has to take to be logged.
+        sample_rate (float): Share of the slow statements to explain.
+        size (int): Number of slow statements kept.
+        explain_timeout (float): Seconds a plan capture may take.
+    """
+
+    def __init__(
+        self, threshold: float, sample_rate: float, size: int, explain_timeout: float
+    ):
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+        self.explain_timeout = explain_timeout
+        self._entries: Deque[Dict[str, Any]] = deque(maxlen=size)
+        self._explaining: asyncio.Task | None = None
+        self._stats = {"slow": 0, "explained": 0, "explain_failures": 0}
+
+    def observe(
+        self,
+        name: str,
+        query: str,
+        params: Sequence[Any] | Mapping[str, Any],
+        elapsed: float,
+    ):
+        """Log a statement that took longer than the threshold, and sample
+        it for a plan capture"""
+        if elapsed < self.threshold:
+            return
+        route = current_route()
+        shape = params_shape(params)
+        logger.warning(
+            "Slow query %s took %.3fs on %s with params %s", name, elapsed, route, shape
+        )
+        entry = {
+            "at": time.time(),
+            "name": name,
+            "route": route,
+            "seconds": elapsed,
+            "params": shape,
+            "query": query,
+            "plan": None,
+        }
+        self._entries.append(entry)
+        self._stats["slow"] += 1
+        if self._explaining is None and random.random() < self.sample_rate:
+            self._explaining = asyncio.create_task(self._explain(entry, query, params))
+
+    async def _plan(
+        self,
+        connection: AsyncConnection,
+        query: str,
+        params: Sequence[Any] | Mapping[str, Any],
+        analyze: bool,
+    ) -> str:
+        async with connection.transaction(force_rollback=True):
+            await connection.execute("SET TRANSACTION READ ONLY")
+            await connection.execute(
+                "SELECT set_config('statement_timeout', %s, true)",
+                (f"{int(self.explain_timeout * 1000)}ms",),
+            )
+            options = "(ANALYZE, BUFFERS) " if analyze else ""
+            cursor = await connection.execute(f"EXPLAIN {options}{query}", params)
+            return "\n".join(row[0] for row in await cursor.fetchall())
+
+    async def _explain(
+        self,
+        entry: Dict[str, Any],
+        query: str,
+        params: Sequence[Any] | Mapping[str, Any],
+    ):
+        # Imported here, tsuki.database runs its statements through this
+        # module
+        from tsuki.database import get_pool
+
+        try:
+            async with get_pool().connection() as connection:
+                try:
+                    entry["plan"] = await self._plan(connection, query, params, True)
+                except errors.ReadOnlySqlTransaction:
+                    entry["plan"] = await self._plan(connection, query, params, False)
+            self._stats["explained"] += 1
+        except Exception as exception:
+            self._stats["explain_failures"] += 1
+            logger.warning(
+                "Capturing the plan of %s failed: %s", entry["name"], exception
+            )
+        finally:
+            self._explaining = None
+
+    def entries(self) -> List[Mapping[str, Any]]:
+        """Slow statements kept, the most recent first"""
+        return list(reversed(self._entries))
+
+    def stats(self) -> Mapping[str, float]:
+        return {**self._stats, "kept": len(self._entries)}
+
+
+slow_queries = SlowQueryLog(
+    secrets.SLOW_QUERY_THRESHOLD,
+    secrets.SLOW_QUERY_SAMPLE_RATE,
+    secrets.SLOW_QUERY_LOG_SIZE,
+    secrets.SLOW_QUERY_EXPLAIN_TIMEOUT,
+)
@@ -7,9 +7,32 @@ var btn2 = document.getElementById("btn-2")
 var span = document.getElementsByClassName("close-1")[0]
 var span2 = document.getElementsByClassName("close-2")[0]
 
+// Fill a modal's list from its data-list URL the first time it is opened
+function loadList(modal) {
+    const list = modal.querySelector("[data-list]");
+    if (list == null || list.dataset.loaded) {
+        return;
+    }
+    list.dataset.loaded = "true";
+    fetch(list.dataset.list)
+        .then(function (response) {
+            if (!response.ok) {
+                throw new Error(response.statusText);
+            }
+            return response.text();
+        })
+        .then(function (html) {
+            list.innerHTML = html;
+        })
+        .catch(function () {
+            delete list.dataset.loaded;
+        });
+}
+
 if (btn1 != null) {
     btn1.onclick = function() {
         modal1.style.display = "block";
+        loadList(modal1);
     }
     span.onclick = function() {
         modal1.style.display = "none";
@@ -19,6 +42,7 @@ if (btn1 != null) {
 if (btn2 != null) {
     btn2.onclick = function() {
         modal2.style.display = "block";
+        loadList(modal2);
     }
     span2.onclick = function() {
         modal2.style.display = "none";
@@ -44,3 +68,67 @@ if (togglePassword != null && password != null) {
         this.classList.toggle("fa-eye-slash");
     });
 }
+
+// Load the next page of a list in place of its "More" link, without
+// JavaScript the link opens the next page on its own
+document.addEventListener("click", function (event) {
+    const link = event.target.closest(".load-more a[data-fragment]");
+    if (link == null) {
+        return;
+    }
+    event.preventDefault();
+    fetch(link.dataset.fragment)
+        .then(function (response) {
+            if (!response.ok) {
+                throw new Error(response.statusText);
+            }
+            return response.text();
+        })
+        .then(function (html) {
+            link.parentElement.insertAdjacentHTML("beforebegin", html);
+            link.parentElement.remove();
+        })
+        .catch(function () {
+            window.location = link.href;
+        });
+});
+
+// Suggest usernames while typing in the search box, only the answer to
+// the latest input is shown
+const suggestInput = document.querySelector("input[data-suggest]");
+
+if (suggestInput != null) {
+    const suggestions = document.getElementById(suggestInput.getAttribute("list"));
+    let timer = null;
+    let latest = 0;
+    suggestInput.addEventListener("input", function () {
+        clearTimeout(timer);
+        const query = suggestInput.value.trim();
+        if (query == "") {
+            suggestions.innerHTML = "";
+            return;
+        }
+        timer = setTimeout(function () {
+            const request = ++latest;
+            fetch(suggestInput.dataset.suggest + "?q=" + encodeURIComponent(query))
+                .then(function (response) {
+                    if (!response.ok) {
+                        throw new Error(response.statusText);
+                    }
+                    return response.json();
+                })
+                .then(function (usernames) {
+                    if (request != latest) {
+                        return;
+                    }
+                    suggestions.innerHTML = "";
+                    usernames.forEach(function (username) {
+                        const option = document.createElement("option");
+                        option.value = username;
+                        suggestions.appendChild(option);
+                    });
+                })
+                .catch(function () {});
+        }, 150);
+    });
+}
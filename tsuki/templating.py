@@ -0,0 +1,25 @@
+from datetime import datetime
+from functools import lru_cache
+
+from fastapi.templating import Jinja2Templates
+
+
+@lru_cache(maxsize=4096)
+def format_timestamp(value: datetime) -> str:
+    """Display format of post, comment and account times, cached as lists
+    show the same times on every render"""
+    return value.strftime("%d %B %Y, %H:%M:%S")
+
+
+def create_templates(directory: str) -> Jinja2Templates:
+    """Templates of the given directory with the app's filters registered.
+
+    Args:
+        directory (str): Directory of the templates.
+
+    Returns:
+        Jinja2Templates: Templates for rendering responses.
+    """
+    templates = Jinja2Templates(directory=directory)
+    templates.env.filters["timestamp"] = format_timestamp
+    return templates
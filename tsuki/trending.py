@@ -0,0 +1,262 @@
+import math
+import time
+from bisect import bisect_left, bisect_right, insort
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Any, Deque, Dict, Iterable, List, Tuple
+
+from tsuki.config import secrets
+from tsuki.database import read_recent_comments, read_recent_votes, read_trending_posts
+from tsuki.models import PostResponse
+
+# Scores are rescaled once their exponent grows past this
+REBASE_EXPONENT = 50.0
+
+
+class Trending:
+    """Incrementally maintained ranking of posts by recent activity.
+
+    Every vote or comment adds a weight that decays exponentially with the
+    given half life, and drops out entirely once it is older than the
+    window. Instead of decaying every score as time passes, new weights
+    are scaled up by exp(decay * (t - t0)), which keeps the order of the
+    ranking the same as that of the decayed scores. A vote taken back
+    cancels the event it added, so exactly its weight is removed.
+
+    Args:
+        window (float): Seconds an event counts towards a post's score.
+        half_life (float): Seconds after which an event's weight halves.
+    """
+
+    def __init__(self, window: float, half_life: float):
+        self.window = window
+        self.decay = math.log(2) / half_life
+        self._origin = time.time()
+        self._scores: Dict[str, float] = {}
+        # Number of events in the window counted in each score
+        self._counts: Dict[str, int] = {}
+        # Posts sorted by descending score, as (-score, post id)
+        self._ranking: List[Tuple[float, str]] = []
+        # Events in the window, as [time, post id, scaled weight, voter],
+        # the weight of a cancelled event is None
+        self._events: Deque[List[Any]] = deque()
+        # Vote events in the window, by (post id, voter)
+        self._votes: Dict[Tuple[str, str], List[Any]] = {}
+
+    def __len__(self) -> int:
+        return len(self._scores)
+
+    def record(
+        self,
+        post_id: str,
+        weight: float,
+        at: float | None = None,
+        voter: str | None = None,
+    ):
+        """Add an event with the given weight to a post, at the given UNIX
+        time or now. Events of a voter can be cancelled later."""
+        now = time.time()
+        at = now if at is None else at
+        if at < now - self.window:
+            return
+        if self.decay * (at - self._origin) > REBASE_EXPONENT:
+            self._rebase(at)
+        scaled = weight * math.exp(self.decay * (at - self._origin))
+        event = [at, post_id, scaled, voter]
+        if voter is not None:
+            self.cancel(post_id, voter)
+            self._votes[post_id, voter] = event
+        self._events.append(event)
+        self._counts[post_id] = self._counts.get(post_id, 0) + 1
+        self._update(post_id, scaled)
+        self._expire(now)
+
+    def cancel(self, post_id: str, voter: str):
+        """Take back the weight a voter's event added to a post, events
+        that already left the window have nothing left to take back"""
+        event = self._votes.pop((post_id, voter), None)
+        if event is None or event[2] is None:
+            return
+        scaled, event[2] = event[2], None
+        if post_id in self._scores:
+            self._update(post_id, -scaled)
+            self._release(post_id)
+
+    def remove(self, post_id: str):
+        """Drop a post from the ranking, e.g. when it is deleted"""
+        score = self._scores.pop(post_id, None)
+        if score is None:
+            return
+        self._ranking.pop(bisect_left(self._ranking, (-score, post_id)))
+        # Events still in the window no longer count towards anything
+        if self._counts.pop(post_id):
+            for event in self._events:
+                if event[1] == post_id:
+                    event[2] = None
+
+    def top(
+        self, k: int, after: Tuple[float, str] | None = None
+    ) -> List[Tuple[str, float]]:
+        """The k highest ranked posts, or the k ranked after the given
+        (rank, post id) key, as (post id, rank) pairs. A rank is the log of
+        a post's score and does not change with the origin, so it can be
+        kept between calls to page through the ranking."""
+        self._expire(time.time())
+        start, after_id = 0, None
+        if after is not None:
+            rank, after_id = after
+            start = bisect_right(self._ranking, (-self._score(rank), after_id))
+        ranked = self._ranking[start : start + k + 1]
+        return [
+            (post_id, self._rank(-score))
+            for score, post_id in ranked
+            if post_id != after_id
+        ][:k]
+
+    def _rank(self, score: float) -> float:
+        return math.log(max(score, 1e-300)) + self.decay * self._origin
+
+    def _score(self, rank: float) -> float:
+        try:
+            return math.exp(rank - self.decay * self._origin)
+        except OverflowError:
+            return math.inf
+
+    def _update(self, post_id: str, scaled: float):
+        score = self._scores.get(post_id)
+        if score is not None:
+            self._ranking.pop(bisect_left(self._ranking, (-score, post_id)))
+            scaled += score
+        self._scores[post_id] = scaled
+        insort(self._ranking, (-scaled, post_id))
+
+    def _release(self, post_id: str):
+        """Drop a post once none of its events count anymore, whatever is
+        left of its score is rounding"""
+        self._counts[post_id] -= 1
+        if not self._counts[post_id]:
+            self.remove(post_id)
+
+    def _expire(self, now: float):
+        """Remove the weight of events that left the window"""
+        while self._events and self._events[0][0] < now - self.window:
+            event = self._events.popleft()
+            _, post_id, scaled, voter = event
+            if voter is not None and self._votes.get((post_id, voter)) is event:
+                del self._votes[post_id, voter]
+            if scaled is not None and post_id in self._scores:
+                self._update(post_id, -scaled)
+                self._release(post_id)
+
+    def _rebase(self, at: float):
+        """Move the origin to the given time so scaled weights stay small,
+        every score shrinks by the same factor so the order is kept"""
+        factor = math.exp(-self.decay * (at - self._origin))
+        self._origin = at
+        self._scores = {
+            post_id: score * factor for post_id, score in self._scores.items()
+        }
+        self._ranking = [(score * factor, post_id) for score, post_id in self._ranking]
+        # Events are shared with the votes they belong to, so they are
+        # rescaled in place
+        for event in self._events:
+            if event[2] is not None:
+                event[2] *= factor
+
+
+trending = Trending(secrets.TRENDING_WINDOW, secrets.TRENDING_HALF_LIFE)
+
+
+def record_vote(post_id: str, username: str, voted: bool, at: float | None = None):
+    """Count a vote, or take the user's vote back when the post was
+    unvoted"""
+    if voted:
+        trending.record(post_id, secrets.TRENDING_VOTE_WEIGHT, at, username)
+    else:
+        trending.cancel(post_id, username)
+
+
+def record_comment(post_id: str, at: float | None = None):
+    trending.record(post_id, secrets.TRENDING_COMMENT_WEIGHT, at)
+
+
+async def seed_trending():
+    """Fill the ranking from the votes and comments in the window on
+    startup"""
+    since = datetime.now(timezone.utc) - timedelta(seconds=trending.window)
+    for post_id, username, voted_at in await read_recent_votes(since):
+        record_vote(post_id, username, True, voted_at.timestamp())
+    for post_id, created_at in await read_recent_comments(since):
+        record_comment(post_id, created_at.timestamp())
+
+
+async def trending_posts(
+    username: str, k: int, after: Tuple[float, str] | None = None
+) -> Tuple[List[PostResponse], Tuple[float, str] | None, bool]:
+    """Fetch up to k trending posts ranked after the given key, leaving out
+    the user's own and the ones recommended to them.
+
+    Args:
+        username (str): User the posts are shown to.
+        k (int): Number of posts to return.
+        after (Tuple[float, str] | None): Rank and id of the last ranked
+        post read for earlier pages, None for the first page.
+
+    Returns:
+        Tuple[List[PostResponse], Tuple[float, str] | None, bool]: Trending
+        posts, highest ranked first, the key to read the next page after
+        and whether more are ranked after it.
+    """
+    posts = []
+    while len(posts) < k:
+        wanted = k - len(posts)
+        ranked = trending.top(wanted, after)
+        if ranked:
+            after = ranked[-1][1], ranked[-1][0]
+            posts.extend(
+                await read_trending_posts(username, [post_id for post_id, _ in ranked])
+            )
+        if len(ranked) < wanted:
+            return posts, after, False
+    return posts, after, True
+
+
+async def blend_trending(
+    username: str,
+    posts: List[PostResponse],
+    limit: int,
+    after: Tuple[float, str] | None = None,
+) -> Tuple[List[PostResponse], Tuple[float, str] | None, bool]:
+    """Mix trending posts into a page of a user's recommendations.
+
+    Pages without recommendations get trending posts only, others get
+    every TRENDING_BLEND-th post replaced by a trending one.
+
+    Args:
+        username (str): User the posts are shown to.
+        posts (List[PostResponse]): Recommended posts of the page.
+        limit (int): Number of posts to return.
+        after (Tuple[float, str] | None): Rank and id of the last ranked
+        post read for earlier pages, None for the first page.
+
+    Returns:
+        Tuple[List[PostResponse], Tuple[float, str] | None, bool]: Blended
+        posts, the key to read the next trending posts after and whether
+        more are ranked after it.
+    """
+    if not posts:
+        return await trending_posts(username, limit, after)
+    every = secrets.TRENDING_BLEND
+    # Short pages are topped up with trending posts as well
+    count = max(limit // every, limit - len(posts))
+    trending_, after, more = await trending_posts(username, count, after)
+    blended = []
+    recommended = iter(posts)
+    extra = iter(trending_)
+    while len(blended) < limit:
+        source = extra if (len(blended) + 1) % every == 0 else recommended
+        post = next(source, None) or next(recommended, None) or next(extra, None)
+        if post is None:
+            break
+        blended.append(post)
+    return blended, after, more
@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, Mapping, Tuple
+
+from tsuki.config import secrets
+from tsuki.database import flush_votes, read_vote_count, toggle_vote, voted
+
+logger = logging.getLogger(__name__)
+
+
+class VoteBuffer:
+    """Write-behind buffer for vote toggles.
+
+    Toggles change an in-memory state per (post, user) instead of the votes
+    table, and the net changes are written in batches. A batch is written
+    every flush_interval seconds, or as soon as flush_size toggles are
+    buffered. Reads through the buffer see the buffered state. When
+    disabled, every call goes straight to the database.
+
+    Args:
+        enabled (bool): Whether toggles are buffered.
+        flush_size (int): Buffered toggles that trigger a flush.
+        flush_interval (float): Seconds a toggle waits to be flushed at most.
+    """
+
+    def __init__(self, enabled: bool, flush_size: int, flush_interval: float):
+        self.enabled = enabled
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        # (post id, username) to (voted before, voted now, voted at)
+        self._pending: Dict[Tuple[str, str], Tuple[bool, bool, datetime]] = {}
+        # The batch being written, still visible to reads until it commits
+        self._flushing: Dict[Tuple[str, str], Tuple[bool, bool, datetime]] = {}
+        # Net change of the vote count of posts, for both of the above
+        self._deltas: Dict[str, int] = defaultdict(int)
+        self._full = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+        self._stats = {
+            "toggles": 0,
+            "flushes": 0,
+            "flushed": 0,
+            "failed_flushes": 0,
+            "flush_seconds": 0.0,
+            "flush_max_seconds": 0.0,
+        }
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def _buffered(self, key: Tuple[str, str]) -> bool | None:
+        entry = self._pending.get(key) or self._flushing.get(key)
+        return None if entry is None else entry[1]
+
+    async def toggle(self, username: str, _id: str) -> Tuple[bool, int]:
+        """Vote on a post or take the vote back, returns whether the user has
+        voted on it now and its vote count"""
+        if not self.enabled:
+            return await toggle_vote(username, _id)
+        key = (_id, username)
+        before = self._buffered(key)
+        if before is None:
+            before = await voted(username, _id)
+            # Another toggle may have been buffered while reading
+            buffered = self._buffered(key)
+            before = before if buffered is None else buffered
+        base = self._pending[key][0] if key in self._pending else before
+        self._pending[key] = (base, not before, datetime.now(timezone.utc))
+        self._deltas[_id] += -1 if before else 1
+        self._stats["toggles"] += 1
+        if len(self._pending) >= self.flush_size:
+            self._full.set()
+        return not before, await self.count(_id)
+
+    async def voted(self, username: str, _id: str) -> bool:
+        """Check if the user has voted on the post, buffered toggles
+        included"""
+        buffered = self._buffered((_id, username))
+        return await voted(username, _id) if buffered is None else buffered
+
+    def delta(self, _id: str) -> int:
+        """Change of the post's vote count not written yet"""
+        return self._deltas.get(_id, 0)
+
+    async def count(self, _id: str) -> int:
+        """Vote count of the post, buffered toggles included"""
+        return max(await read_vote_count(_id) + self.delta(_id), 0)
+
+    async def flush(self) -> int:
+        """Write the buffered toggles that changed a vote in one batch,
+        returns the number written"""
+        async with self._lock:
+            return await self._flush()
+
+    async def _flush(self) -> int:
+        if not self._pending:
+            return 0
+        self._flushing, self._pending = self._pending, {}
+        changes = [
+            (_id, username, after, at)
+            for (_id, username), (before, after, at) in self._flushing.items()
+            if before != after
+        ]
+        start = time.perf_counter()
+        try:
+            await flush_votes(changes)
+        except Exception as exception:
+            self._stats["failed_flushes"] += 1
+            logger.warning("Vote flush failed, retrying later: %s", exception)
+            # Toggles buffered since keep their state, on top of the base
+            # of the batch that failed
+            for key, (before, after, at) in self._flushing.items():
+                if key in self._pending:
+                    after, at = self._pending[key][1:]
+                self._pending[key] = (before, after, at)
+            self._flushing = {}
+            return 0
+        for (_id, _), (before, after, _) in self._flushing.items():
+            self._deltas[_id] -= int(after) - int(before)
+            if not self._deltas[_id]:
+                del self._deltas[_id]
+        self._flushing = {}
+        elapsed = time.perf_counter() - start
+        self._stats["flushes"] += 1
+        self._stats["flushed"] += len(changes)
+        self._stats["flush_seconds"] += elapsed
+        self._stats["flush_max_seconds"] = max(
+            self._stats["flush_max_seconds"], elapsed
+        )
+        return len(changes)
+
+    async def _flusher(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                ...
+            self._full.clear()
+            # Stopping waits for a flush under way instead of cancelling it
+            await asyncio.shield(self.flush())
+
+    def start(self):
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._flusher())
+
+    async def stop(self):
+        """Stop flushing periodically and write whatever is still buffered"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                ...
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> Mapping[str, float]:
+        return {
+            **self._stats,
+            "enabled": self.enabled,
+            "pending": len(self._pending),
+        }
+
+
+vote_buffer = VoteBuffer(
+    secrets.VOTE_BUFFER, secrets.VOTE_FLUSH_SIZE, secrets.VOTE_FLUSH_INTERVAL
+)